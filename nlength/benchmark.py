@@ -0,0 +1,206 @@
+import sys
+import re
+import io
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+from nlength.tree import Tree, write_trees
+from nlength.treebank import Treebank
+from nlength.measures import nelson_scores
+from nlength.plot_items import get_nelson_scores
+
+
+LINETREES = 'ling_preds/conlenc.gold.linetrees'
+
+
+def legacy_read(t, s, fIndex=0):
+    # The previous regex-and-slice Tree.read (quadratic in tree length, one recursion per node), for comparison
+    t.ch = []
+    m = re.search('^ *([^ ()]+) *(.*)', s)
+    if m != None:
+        (t.c, s) = m.groups()
+        t.l = fIndex
+        t.r = fIndex
+        return s, fIndex + 1
+    m = re.search('^ *\( *([^ ()]*) *(.*)', s)
+    if m != None:
+        (t.c, s) = m.groups()
+        t.l = fIndex
+        while True:
+            m = re.search('^ *\) *(.*)', s)
+            if m != None:
+                return m.group(1), fIndex
+            ch = Tree()
+            s, fIndex = legacy_read(ch, s, fIndex)
+            t.ch += [ch]
+            ch.p = t
+            t.r = ch.r
+    return ''
+
+
+def same_tree(a, b):
+    # Compare category, span, children and parent links of two trees without recursion
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if a.c != b.c or a.l != b.l or a.r != b.r or len(a.ch) != len(b.ch):
+            return False
+        for x, y in zip(a.ch, b.ch):
+            if x.p is not a or y.p is not b:
+                return False
+            stack.append((x, y))
+    return True
+
+
+def read_lines(path):
+    with open(path, 'r') as f:
+        return f.readlines()
+
+
+def synthetic_lines(lines, scale=1000, seed=0):
+    # A treebank `scale` times larger, drawn from the real trees with shuffled leaf words
+    rng = np.random.default_rng(seed)
+    words = []
+    for line in lines:
+        t = Tree()
+        t.read(line)
+        words.extend(t.iter_words())
+    words = np.array(words)
+    out = []
+    for i in rng.integers(0, len(lines), size=len(lines) * scale):
+        line = lines[i]
+        n = len(re.findall('[^ ()]+\)', line))
+        leaves = iter(words[rng.integers(0, len(words), size=n)])
+        out.append(re.sub('([^ ()]+)\)', lambda m: next(leaves) + ')', line))
+    return out
+
+
+def deep_line(depth):
+    # One right-branching tree `depth` constituents deep
+    return '(X a ' * depth + 'a' + ')' * depth + '\n'
+
+
+def time_read(lines, reader):
+    t0 = time.time()
+    n = 0
+    for line in lines:
+        t = Tree()
+        reader(t, line)
+        n += 1
+    return time.time() - t0, n
+
+
+def tree_memory(lines):
+    # Bytes allocated to hold the lines as Tree object graphs
+    tracemalloc.start()
+    trees = []
+    for line in lines:
+        t = Tree()
+        t.read(line)
+        trees.append(t)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def legacy_str(t):
+    # The previous recursive, concatenating Tree.__str__, for comparison
+    if t.ch == []:
+        if not hasattr(t, 'e'):
+            return t.c
+        return t.c + '[' + str(t.e) + ']'
+    s = '(' + t.c
+    if hasattr(t, 'e'):
+        s += '[' + str(t.e) + ']'
+    for ch in t.ch:
+        s += ' ' + legacy_str(ch)
+    return s + ')'
+
+
+def report(name, secs, n):
+    sys.stderr.write('%s: %d trees in %.2fs (%.1f us/tree)\n' % (name, n, secs, secs / max(n, 1) * 1e6))
+    sys.stderr.flush()
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Benchmark tree reading on the gold linetrees and on a synthetic treebank.
+    ''')
+    argparser.add_argument('-s', '--scale', type=int, default=1000, help='Size of the synthetic treebank as a multiple of the gold linetrees.')
+    argparser.add_argument('-d', '--depth', type=int, default=5000, help='Depth of the synthetic deep tree.')
+    argparser.add_argument('--legacy_sample', type=int, default=10000, help='Number of synthetic trees to time with the legacy reader.')
+    args = argparser.parse_args()
+
+    lines = read_lines(LINETREES)
+
+    n_bad = 0
+    for line in lines:
+        a = Tree()
+        b = Tree()
+        a.read(line)
+        legacy_read(b, line)
+        n_bad += not same_tree(a, b)
+    sys.stderr.write('Trees differing from legacy reader: %d of %d\n' % (n_bad, len(lines)))
+
+    report('gold (legacy)', *time_read(lines, legacy_read))
+    report('gold', *time_read(lines, Tree.read))
+
+    synthetic = synthetic_lines(lines, scale=args.scale)
+    report('synthetic x%d (legacy, first %d)' % (args.scale, args.legacy_sample), *time_read(synthetic[:args.legacy_sample], legacy_read))
+    report('synthetic x%d' % args.scale, *time_read(synthetic, Tree.read))
+
+    t0 = time.time()
+    treebank = Treebank.from_lines(synthetic)
+    report('synthetic x%d (Treebank)' % args.scale, time.time() - t0, len(treebank))
+    treebank = Treebank.from_lines(lines)
+    sys.stderr.write('Memory per node: %.1f bytes (Tree), %.1f bytes (Treebank)\n' % (
+        tree_memory(lines) / treebank.n_nodes, treebank.nbytes / treebank.n_nodes))
+
+    trees = []
+    for line in synthetic:
+        t = Tree()
+        t.read(line)
+        trees.append(t)
+    t0 = time.time()
+    for t in trees:
+        t.collapseUnary()
+        get_nelson_scores(t)
+    report('nelson scores x%d (recursive)' % args.scale, time.time() - t0, len(trees))
+    del trees
+    treebank = Treebank.from_lines(synthetic)
+    t0 = time.time()
+    nelson_scores(treebank)
+    report('nelson scores x%d (batch)' % args.scale, time.time() - t0, len(treebank))
+
+    trees = []
+    for line in synthetic:
+        t = Tree()
+        t.read(line)
+        trees.append(t)
+    t0 = time.time()
+    f = io.StringIO()
+    for t in trees:
+        f.write(legacy_str(t) + '\n')
+    report('write x%d (legacy)' % args.scale, time.time() - t0, len(trees))
+    t0 = time.time()
+    write_trees(trees, io.StringIO())
+    report('write x%d' % args.scale, time.time() - t0, len(trees))
+    del trees
+    t0 = time.time()
+    lines_out = list(treebank.lines())
+    report('write x%d (Treebank)' % args.scale, time.time() - t0, len(treebank))
+    sys.stderr.write('Treebank lines differing from input: %d\n' % sum(a != b.strip() for a, b in zip(lines_out, synthetic)))
+
+    deep = [deep_line(args.depth)]
+    report('deep (%d)' % args.depth, *time_read(deep, Tree.read))
+    try:
+        report('deep (%d, legacy)' % args.depth, *time_read(deep, legacy_read))
+    except RecursionError:
+        sys.stderr.write('deep (%d, legacy): RecursionError\n' % args.depth)
+        sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
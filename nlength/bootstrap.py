@@ -0,0 +1,172 @@
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from nlength.group import PARCEL_SETS, EXPERIMENTS, read_all_contrasts
+
+
+KEY_COLUMNS = ['Subject', 'fROI']
+CI_METHODS = ['percentile', 'bca']
+
+
+def resample_weights(rng, n, size):
+    # Count weights [size, n] of `size` subject resamples, from a single [size, n] index matrix
+    idx = rng.integers(0, n, size=(size, n))
+    idx += (np.arange(size) * n)[:, None]
+    return np.bincount(idx.ravel(), minlength=size * n).reshape(size, n).astype(float)
+
+
+def subject_sums(Y):
+    # Per-subject sums and counts of Y [n_subj, ...] flattened to [n_subj, k], with NaNs left out
+    Y = Y.reshape(len(Y), -1)
+    N = np.isfinite(Y)
+    return np.where(N, Y, 0.), N.astype(float)
+
+
+def bootstrap_means(S, N, n_boot=10000, seed=None, chunk_size=None):
+    # Means of every column for n_boot subject resamples: (W @ S) / (W @ N).
+    # With chunk_size, weights are drawn and applied in chunks so the index matrix stays small.
+    n = len(S)
+    if not chunk_size:
+        chunk_size = n_boot
+    sizes = [chunk_size] * (n_boot // chunk_size)
+    if n_boot % chunk_size:
+        sizes.append(n_boot % chunk_size)
+    out = np.empty((n_boot, S.shape[1]))
+    i = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for size, ss in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))):
+            W = resample_weights(np.random.default_rng(ss), n, size)
+            out[i:i + size] = np.dot(W, S) / np.dot(W, N)
+            i += size
+    return out
+
+
+def jackknife_means(S, N):
+    # Leave-one-subject-out means [n_subj, k]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (S.sum(axis=0) - S) / (N.sum(axis=0) - N)
+
+
+def column_quantiles(boot, q):
+    # Linear-interpolated quantiles of each column of boot at per-column levels q (cf. np.quantile)
+    boot = np.sort(boot, axis=0)
+    B, k = boot.shape
+    pos = np.clip(q, 0, 1) * (B - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, B - 1)
+    frac = pos - lo
+    cols = np.arange(k)
+    return boot[lo, cols] * (1 - frac) + boot[hi, cols] * frac
+
+
+def percentile_ci(boot, level=0.95):
+    alpha = (1 - level) / 2
+    k = boot.shape[1]
+    return column_quantiles(boot, np.full(k, alpha)), column_quantiles(boot, np.full(k, 1 - alpha))
+
+
+def bca_ci(boot, theta, jack, level=0.95):
+    # Bias-corrected and accelerated intervals: bias from the share of resamples below the estimate,
+    # acceleration from the skewness of the jackknife estimates
+    B = len(boot)
+    below = (boot < theta).sum(axis=0) + 0.5 * (boot == theta).sum(axis=0)
+    z0 = stats.norm.ppf(np.clip(below / B, 1. / B, 1 - 1. / B))
+    d = np.nanmean(jack, axis=0) - jack
+    num = np.nansum(d ** 3, axis=0)
+    den = 6 * np.nansum(d ** 2, axis=0) ** 1.5
+    a = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+    alpha = (1 - level) / 2
+    out = []
+    for z in stats.norm.ppf([alpha, 1 - alpha]):
+        q = stats.norm.cdf(z0 + (z0 + z) / (1 - a * (z0 + z)))
+        out.append(column_quantiles(boot, q))
+    return tuple(out)
+
+
+def mean_ci(Y, method='bca', n_boot=10000, level=0.95, seed=None, chunk_size=None):
+    # Mean over subjects (axis 0) of Y with bootstrap confidence limits, for all other cells of Y at once
+    shape = Y.shape[1:]
+    S, N = subject_sums(Y)
+    return sums_ci(S, N, method=method, n_boot=n_boot, level=level, seed=seed, chunk_size=chunk_size, shape=shape)
+
+
+def sums_ci(S, N, method='bca', n_boot=10000, level=0.95, seed=None, chunk_size=None, shape=None):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        theta = S.sum(axis=0) / N.sum(axis=0)
+    boot = bootstrap_means(S, N, n_boot=n_boot, seed=seed, chunk_size=chunk_size)
+    if method == 'percentile':
+        lower, upper = percentile_ci(boot, level=level)
+    elif method == 'bca':
+        lower, upper = bca_ci(boot, theta, jackknife_means(S, N), level=level)
+    else:
+        raise ValueError('Unrecognized CI method: %s' % method)
+    if shape is not None:
+        theta, lower, upper = theta.reshape(shape), lower.reshape(shape), upper.reshape(shape)
+    return theta, lower, upper
+
+
+def table_ci(df, contrasts=None, method='bca', n_boot=10000, level=0.95, seed=None, chunk_size=None):
+    # Bootstrap CIs of every contrast column of a contrast table, per fROI and pooled over fROIs ('all'),
+    # resampling subjects (all of a subject's fROIs together)
+    if contrasts is None:
+        contrasts = [x for x in df.columns if x not in KEY_COLUMNS]
+    fROIs = list(pd.unique(df.fROI))
+    wide = df.pivot_table(index='Subject', columns='fROI', values=contrasts, aggfunc='first', dropna=False)
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([contrasts, fROIs]))
+    Y = wide.values.astype(float).reshape(len(wide), len(contrasts), len(fROIs))
+    S, N = subject_sums(Y)
+    S_all = np.where(np.isfinite(Y), Y, 0.).sum(axis=2)
+    N_all = np.isfinite(Y).sum(axis=2).astype(float)
+    S = np.concatenate([S_all, S], axis=1)
+    N = np.concatenate([N_all, N], axis=1)
+
+    theta, lower, upper = sums_ci(S, N, method=method, n_boot=n_boot, level=level, seed=seed, chunk_size=chunk_size)
+    return pd.DataFrame({
+        'contrast': np.concatenate([contrasts, np.repeat(contrasts, len(fROIs))]),
+        'fROI': ['all'] * len(contrasts) + fROIs * len(contrasts),
+        'mean': theta,
+        'lower': lower,
+        'upper': upper
+    })
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Bootstrap confidence intervals (resampling subjects) for every contrast by fROI.
+    ''')
+    argparser.add_argument('-m', '--method', default='bca', choices=CI_METHODS, help='Interval type.')
+    argparser.add_argument('-n', '--n_boot', type=int, default=10000, help='Number of bootstrap resamples.')
+    argparser.add_argument('-l', '--level', type=float, default=0.95, help='Confidence level.')
+    argparser.add_argument('-s', '--seed', type=int, default=None, help='Random seed.')
+    argparser.add_argument('-c', '--chunk_size', type=int, default=None, help='Resamples per chunk (for large cohorts).')
+    argparser.add_argument('-o', '--output', default='bootstrap.csv', help='Path to the results table.')
+    args = argparser.parse_args()
+
+    t0 = time.time()
+    try:
+        data = read_all_contrasts()
+    except FileNotFoundError:
+        sys.stderr.write('Contrast files not found. Run `python -m nlength.contrasts` before running this script.\n')
+        sys.stderr.flush()
+        exit()
+
+    out = []
+    for parcel_set in PARCEL_SETS:
+        for experiment in EXPERIMENTS:
+            _out = table_ci(data[(parcel_set, experiment)], method=args.method, n_boot=args.n_boot, level=args.level,
+                            seed=args.seed, chunk_size=args.chunk_size)
+            _out.insert(0, 'experiment', experiment)
+            _out.insert(0, 'parcel_set', parcel_set)
+            out.append(_out)
+    out = pd.concat(out, axis=0, ignore_index=True)
+    out.to_csv(args.output, index=False)
+    sys.stderr.write('Bootstrapped %d estimates (%d resamples) in %.2fs\n' % (len(out), args.n_boot, time.time() - t0))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
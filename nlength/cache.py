@@ -0,0 +1,287 @@
+import sys
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+
+CACHE_VERSION = 1
+MAGIC = b'NLCACHE1'
+ALIGN = 64
+
+EFFECT_SCHEMA = {
+    'Subject': 'category',
+    'Effect': 'category',
+    'ROI': 'int',
+    'EffectSize': 'float',
+}
+
+ITEM_COUNTS = [
+    'wlen', 'sentid', 'sentpos', 'conlen', 'dlt', 'dltc', 'dltv', 'dltm', 'dltcv', 'dltcm', 'dltvm', 'dltcvm', 'dlts',
+    'startembdAny', 'endembdAny', 'embddepthAny', 'embdlen', 'noF', 'noFlen', 'noFdr', 'noFdrv', 'yesJ',
+    'embddepthMin'
+]
+ITEM_SCHEMA = {
+    'word': 'category',
+    'docid': 'category',
+    'cond': 'category',
+    'condcode': 'category',
+    'pos': 'category',
+    'unigramsurp': 'float',
+    'fwprob5surp': 'float',
+    'totsurp': 'float',
+}
+ITEM_SCHEMA.update({x: 'int32' for x in ITEM_COUNTS})
+DTYPES = {'int': 'int64', 'float': 'float64'}
+
+
+def get_cache_dir():
+    return os.environ.get('NLENGTH_CACHE', '.nlength_cache')
+
+
+def get_cache_size():
+    # LRU cap in bytes (NLENGTH_CACHE_SIZE is given in MB)
+    return int(float(os.environ.get('NLENGTH_CACHE_SIZE', 2048)) * 2 ** 20)
+
+
+# Array container: magic, uint64 header length, JSON header, then 64-byte aligned raw arrays.
+# The header records dtype, shape and offset of every array plus arbitrary JSON metadata,
+# so the whole file can be memory-mapped (or read with a single read) and sliced into arrays.
+
+def write_arrays(path, arrays, meta=None):
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    header = {'arrays': {}, 'meta': meta or {}}
+    offset = 0
+    for name, a in arrays.items():
+        header['arrays'][name] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+    header_bytes = json.dumps(header).encode('utf-8')
+    start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, a in arrays.items():
+            f.seek(start + header['arrays'][name]['offset'])
+            f.write(a.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_arrays(path, mmap=True):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not an nlength cache file.' % path)
+        n = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(n).decode('utf-8'))
+        start = -(-(len(MAGIC) + 8 + n) // ALIGN) * ALIGN
+        if mmap:
+            buf = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            f.seek(0)
+            buf = np.frombuffer(f.read(), dtype=np.uint8)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        offset = start + spec['offset']
+        arrays[name] = buf[offset:offset + nbytes].view(dtype).reshape(shape)
+
+    return arrays, header['meta']
+
+
+def get_key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def source_key(path, **kwargs):
+    # Identify a source file by absolute path, size and mtime, plus any parsing options
+    st = os.stat(path)
+    return get_key(CACHE_VERSION, os.path.abspath(path), st.st_size, st.st_mtime_ns, kwargs)
+
+
+def cache_path(key, kind='table'):
+    return os.path.join(get_cache_dir(), '%s_%s.nlc' % (kind, key))
+
+
+def touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict(max_size=None, keep=()):
+    # Drop least recently used entries until the cache fits under max_size bytes. Paths in keep (e.g. an entry
+    # that is about to be read) are never dropped, even if the cache stays over max_size.
+    keep = {os.path.abspath(x) for x in keep}
+    if max_size is None:
+        max_size = get_cache_size()
+    directory = get_cache_dir()
+    if not os.path.exists(directory):
+        return
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.nlc'):
+            path = os.path.join(directory, name)
+            st = os.stat(path)
+            entries.append((st.st_mtime_ns, st.st_size, path))
+    entries.sort()
+    total = sum(x[1] for x in entries)
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear():
+    directory = get_cache_dir()
+    n = 0
+    if os.path.exists(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.nlc') or name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+                n += 1
+    return n
+
+
+def encode_table(df, schema=None):
+    schema = schema or {}
+    arrays = {}
+    columns = []
+    for col in df.columns:
+        kind = schema.get(col)
+        x = df[col]
+        if kind is None:
+            if x.dtype == object or isinstance(x.dtype, pd.CategoricalDtype):
+                kind = 'category'
+            else:
+                kind = x.dtype.str
+        if kind == 'category':
+            x = pd.Categorical(x)
+            arrays[col] = x.codes.astype(np.int32)
+            columns.append({'name': col, 'kind': kind, 'categories': x.categories.tolist()})
+        else:
+            if kind == 'int':
+                x = x.astype(np.int64)
+            elif kind == 'float':
+                x = x.astype(np.float64)
+            else:
+                x = x.astype(kind)
+            arrays[col] = x.values
+            columns.append({'name': col, 'kind': kind})
+
+    return arrays, {'columns': columns, 'nrow': len(df)}
+
+
+def decode_table(arrays, meta):
+    data = {}
+    for col in meta['columns']:
+        name = col['name']
+        if col['kind'] == 'category':
+            data[name] = pd.Categorical.from_codes(arrays[name], col['categories'])
+        else:
+            data[name] = arrays[name]
+    return pd.DataFrame(data, index=pd.RangeIndex(meta['nrow']), copy=False)
+
+
+def read_table(path, schema=None, **kwargs):
+    # pd.read_csv through the binary cache, keyed by source path, size, mtime and read options.
+    # Object columns (and any column typed 'category' in schema) are stored as categoricals.
+    key = source_key(path, schema=schema, **kwargs)
+    cached = cache_path(key)
+    if os.path.exists(cached):
+        try:
+            arrays, meta = read_arrays(cached)
+            touch(cached)
+            return decode_table(arrays, meta)
+        except (ValueError, KeyError, OSError):
+            pass
+
+    df = pd.read_csv(path, **kwargs)
+    arrays, meta = encode_table(df, schema=schema)
+    meta['source'] = os.path.abspath(path)
+    try:
+        write_arrays(cached, arrays, meta)
+        evict()
+    except OSError as e:
+        sys.stderr.write('Could not write cache entry for %s (%s).\n' % (path, e))
+
+    return decode_table(arrays, meta)
+
+
+def read_effect_sizes(path, **kwargs):
+    return read_table(path, schema=EFFECT_SCHEMA, **kwargs)
+
+
+def item_key(docid, sentpos):
+    # Integer (docid, sentpos) key for grouping or joining item rows: the code of docid among its sorted
+    # distinct values, times one more than the largest sentpos, plus sentpos. Any docid strings work and
+    # distinct pairs never collide, but codes depend on the docids passed in, so keys are only comparable
+    # within one call (to join two tables, key their concatenation). Like the string keys it replaces, it is
+    # shared by the sentences of a multi-sentence item.
+    codes = pd.Categorical(docid).codes.astype(np.int64)
+    if (codes < 0).any():
+        raise ValueError('Missing docid.')
+    sentpos = np.asarray(sentpos, dtype=np.int64)
+    if not len(sentpos):
+        return sentpos
+    if sentpos.min() < 0:
+        raise ValueError('Negative sentpos.')
+    base = int(sentpos.max()) + 1
+    if int(codes.max()) >= np.iinfo(np.int64).max // base:
+        raise ValueError('Too many (docid, sentpos) pairs for an int64 item key.')
+    return codes * base + sentpos
+
+
+def read_itemmeasures(path, columns=None, **kwargs):
+    # Typed itemmeasures table restricted to `columns`, through the binary cache. Only the requested columns
+    # are parsed, with dtypes from ITEM_SCHEMA; docid, cond, condcode and word come back as categoricals.
+    kwargs.setdefault('sep', ' ')
+    if columns is not None:
+        columns = list(columns)
+        kwargs['usecols'] = columns
+    schema = ITEM_SCHEMA if columns is None else {x: ITEM_SCHEMA[x] for x in columns if x in ITEM_SCHEMA}
+    kwargs['dtype'] = {x: DTYPES.get(y, y) for x, y in schema.items()}
+    df = read_table(path, schema=schema, **kwargs)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Inspect or invalidate the binary cache of parsed input tables.
+    ''')
+    argparser.add_argument('-c', '--clear', action='store_true', help='Delete all cache entries.')
+    argparser.add_argument('-m', '--max_size', type=float, default=None, help='Evict LRU entries down to this many MB.')
+    args = argparser.parse_args()
+
+    if args.clear:
+        n = clear()
+        print('Removed %d cache entries from %s' % (n, get_cache_dir()))
+    elif args.max_size is not None:
+        evict(int(args.max_size * 2 ** 20))
+    directory = get_cache_dir()
+    if os.path.exists(directory):
+        sizes = [os.path.getsize(os.path.join(directory, x)) for x in os.listdir(directory) if x.endswith('.nlc')]
+        print('%s: %d entries, %.1f MB' % (directory, len(sizes), sum(sizes) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import sys
+import numpy as np
+
+
+evlab_parcels =  [
+    'LIFGorb',
+    'LIFG',
+    'LMFG',
+    'LAntTemp',
+    'LPostTemp',
+    'LAngG',
+    'RIFGorb',
+    'RIFG',
+    'RMFG',
+    'RAntTemp',
+    'RPostTemp',
+    'RAngG'
+]
+
+PDD_parcels = [
+    'LIFGorb',
+    'LIFGtri',
+    'LTP',
+    'LaSTS',
+    'LpSTS',
+    'LTPJ',
+]
+
+fROIs = {
+    'evlab': evlab_parcels,
+    'PDD': PDD_parcels,
+    'PDDanat': PDD_parcels,
+    'RH': evlab_parcels,
+}
+
+networks = {
+    'evlab': [
+        'LIFGorb',
+        'LIFG',
+        'LMFG',
+        'LAntTemp',
+        'LPostTemp',
+        'LAngG',
+    ],
+    'PDD': [
+        'LIFGorb',
+        'LIFGtri',
+        'LTP',
+        'LaSTS',
+        'LpSTS',
+        'LTPJ',
+    ],
+    'RH': [
+        'RIFGorb',
+        'RIFG',
+        'RMFG',
+        'RAntTemp',
+        'RPostTemp',
+        'RAngG',
+    ],
+}
+networks['PDDanat'] = networks['PDD']
+
+parcel_set_map = {
+    'evlab': 'func_parcels',
+    'PDD': 'PDD_parcels',
+    'RH': 'func_parcels',
+    'PDDanat': 'PDD_parcels_anat'
+}
+experiments = (1, 2)
+
+LENGTH2X = {
+    1: 0.,
+    2: 1.,
+    3: 2.,
+    4: 3.,
+    5: 3.5,
+    6: 4.,
+    8: 4.33,
+    10: 4.66,
+    12: 5.
+}
+
+
+def length2x(x):
+    x = np.array(x)
+    f = np.vectorize(lambda x: LENGTH2X[int(x)])
+    return f(x)
+
+
+_base_path = None
+
+
+def get_base_path():
+    # Read lazily so that importing this module never touches the filesystem
+    global _base_path
+    if _base_path is None:
+        try:
+            with open('data_path.txt', 'r') as f:
+                _base_path = f.read().strip()
+        except FileNotFoundError:
+            sys.stderr.write('Data path not set. Run `python -m nlength.set_data_path` before running any other scripts.\n')
+            sys.stderr.flush()
+            exit()
+    return _base_path
@@ -1,550 +1,394 @@
 import sys
 import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-
-
-evlab_parcels =  [
-    'LIFGorb',
-    'LIFG',
-    'LMFG',
-    'LAntTemp',
-    'LPostTemp',
-    'LAngG',
-    'RIFGorb',
-    'RIFG',
-    'RMFG',
-    'RAntTemp',
-    'RPostTemp',
-    'RAngG'
-]
-
-PDD_parcels = [
-    'LIFGorb',
-    'LIFGtri',
-    'LTP',
-    'LaSTS',
-    'LpSTS',
-    'LTPJ',
-]
-
-fROIs = {
-    'evlab': evlab_parcels,
-    'PDD': PDD_parcels,
-    'PDDanat': PDD_parcels,
-    'RH': evlab_parcels,
-}
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-networks = {
-    'evlab': [
-        'LIFGorb',
-        'LIFG',
-        'LMFG',
-        'LAntTemp',
-        'LPostTemp',
-        'LAngG',
-    ],
-    'PDD': [
-        'LIFGorb',
-        'LIFGtri',
-        'LTP',
-        'LaSTS',
-        'LpSTS',
-        'LTPJ',
-    ],
-    'RH': [
-        'RIFGorb',
-        'RIFG',
-        'RMFG',
-        'RAntTemp',
-        'RPostTemp',
-        'RAngG',
-    ],
-}
-networks['PDDanat'] = networks['PDD']
+from nlength.config import fROIs, networks, parcel_set_map, experiments, length2x, get_base_path
+from nlength.effects import decode_effects
+from nlength.load import LoadPlan, unit_sources, network_rois
+from nlength.tensor import pivot_effects, apply_contrasts, combine, nansem, fit_slopes
+from nlength.bootstrap import CI_METHODS, mean_ci
 
-parcel_set_map = {
-    'evlab': 'func_parcels',
-    'PDD': 'PDD_parcels',
-    'RH': 'func_parcels',
-    'PDDanat': 'PDD_parcels_anat'
-}
-experiments = (1, 2)
 
-try:
-    with open('data_path.txt', 'r') as f:
-        base_path = f.read().strip()
-except FileNotFoundError:
-    sys.stderr.write('Data path not set. Run `python -m nlength.set_data_path` before running any other scripts.\n')
-    sys.stderr.flush()
-    exit()
-
-LENGTH2X = {
-    1: 0.,
-    2: 1.,
-    3: 2.,
-    4: 3.,
-    5: 3.5,
-    6: 4.,
-    8: 4.33,
-    10: 4.66,
-    12: 5.
+NLENGTH_COLUMNS = {
+    1: ['C', 'C1412', 'C126', 'NLenC', 'S_v_W'],
+    2: ['C', 'C1412', 'C126', 'C34', 'N', 'J', 'C_v_J', 'C_v_N', 'NLenC', 'NLenJ', 'NLenN', 'NLenC_v_NLenJ',
+        'NLenC_v_NLenN', 'NLenJ_v_NLenN', 'S_v_W', 'S_v_N', 'J_v_W', 'J_v_N', 'S_v_W_v_J_v_N']
 }
+J_LENGTHS = [1, 4, 12]
+N_LENGTHS = [3, 4]
+WL24_LENGTHS = [1, 2, 3, 4, 6, 8, 12]
+WL30_LENGTHS = [1, 2, 3, 5, 6, 10]
 
-def length2x(x):
-    x = np.array(x)
-    f = np.vectorize(lambda x: LENGTH2X[int(x)])
-    return f(x)
 
-for parcel_set in parcel_set_map:
-    parcel_set_path = parcel_set_map[parcel_set]
+def get_ylims(parcel_set):
     ylims = {'': (-0.68, 3.5)}
     if parcel_set == 'PDDanat':
         ylims['_tight'] = (-0.4, 1.35)
-    for experiment in experiments:
-        if experiment == 1:
-            df = pd.read_csv(os.path.join(base_path, 'main', 'nlength_con_n16', parcel_set_path, 'mROI_NlengthEFFECT_langLOC',
-                             'spm_ss_mROI_data.details.EffectSize.csv'))
-            df = df[df.Subject != '430_FED_20170523b_3T2_PL2017']  # Drop repeated session by subject 430
-            lengths = [1, 2, 4, 6, 12]  # Length 3 condition missing
-        else:
-            df = []
-            for subj_set in ('old_subjects_n25', 'new_subjects_n15'):
-                df.append(pd.read_csv(os.path.join(base_path, 'main', subj_set, parcel_set_path, 'mROI_NlengthEFFECT_langLOC',
-                                 'spm_ss_mROI_data.details.EffectSize.csv')))
-                if subj_set == 'old_subjects_n25':
-                    df.append(pd.read_csv(os.path.join(base_path, 'main', subj_set, parcel_set_path, 'mROI_NlengthEFFECT_langrun1LOC',
-                                 'spm_ss_mROI_data.details.EffectSize.csv')))
-            df = pd.concat(df, axis=0)
-            lengths = [1, 2, 3, 4, 6, 12]
-
-        plot_basis = length2x(lengths)
-
-        xtick_pos = plot_basis
-        xtick_labels = [str(x) for x in lengths]
-
-        plot_path = 'plots'
-        contrast_path = 'contrasts'
-
-        if not os.path.exists(plot_path):
-            os.makedirs(plot_path)
-
-        if not os.path.exists(contrast_path):
-            os.makedirs(contrast_path)
-
-        df.ROI = df.ROI.apply(lambda x: fROIs[parcel_set][x-1])
-        df = df[df.ROI.isin(networks[parcel_set])]
-        df = df[~df.Effect.str.contains('-')]
-        df['StimType'] = np.zeros_like(df.Effect)
-        df.StimType[df.Effect.str.contains('jab')] = 'J'
-        df.StimType[df.Effect.str.contains('nc')] = 'N'
-        df.StimType[(~df.Effect.str.contains('nc')) & (~df.Effect.str.contains('jab'))] = 'C'
-        df['nlength'] = df.Effect.str.extract('(\d+)').astype(int)
-
-        out = []
-
-
-        for ROI in networks[parcel_set]:
-            # Plot
-            plt.gca().spines['top'].set_visible(False)
-            plt.gca().spines['right'].set_visible(False)
-            plt.gca().spines['bottom'].set_visible(False)
-            plt.gca().spines['left'].set_visible(True)
-            plt.gca().tick_params(labelleft='on', labelbottom='on')
-            plt.gca().yaxis.set_ticks_position('left')
-            plt.gca().xaxis.set_ticks_position('none')
-            # ax.grid(b=True, which='major', axis='y', ls='--', lw=.5, c='k', alpha=.3)
-            plt.gca().axhline(y=0, lw=1, c='gray', alpha=1)
-
-            _df = df[df.StimType == 'C']
-            clens = [1, 2, 3, 4, 6, 12]
-            means = []
-            errs = []
-            D_C = []
-            subjects = None
-            for i, clen in enumerate(clens):
-                d = _df[(_df.nlength == clen) & (_df.ROI == ROI)]
-                if len(d.values):
-                    d = d.sort_values('Subject')
-                    if subjects is None:
-                        subjects = d.Subject.values
-                    d = d.EffectSize
-                    m = d.mean()
-                    means.append(m)
-                    sem = d.sem()
-                    errs.append(sem)
-                    D_C.append(d.values)
-            D_C = np.stack(D_C, axis=1)
-
-            b = np.linalg.lstsq(np.stack([np.ones_like(means), plot_basis], axis=1), D_C.T)[0]
-            NLenC = b[1]
-
-            xline = np.linspace(plot_basis.min(), plot_basis.max(), 500)
-            X = np.stack([np.ones_like(xline), xline], axis=1)
-            yline = np.dot(X, b).mean(axis=-1)
-
-            plt.errorbar(
-                plot_basis,
-                means,
-                yerr=errs,
-                fmt='ro',
-                linestyle='none',
-                ecolor='red',
-                lw=2,
-                capsize=0,
-                label='normal'
-            )
-            plt.plot(
-                xline,
-                yline,
-                linestyle='dashed',
-                color='red',
-            )
-
-            if experiment == 2:
-                _df = df[df.StimType == 'J']
-                clens = [1, 4, 12]
-                means = []
-                errs = []
-                D_J = []
-                for i, clen in enumerate(clens):
-                    d = _df[(_df.nlength == clen) & (_df.ROI == ROI)]
-                    d = d.sort_values('Subject')
-                    d = d.EffectSize
-                    m = d.mean()
-                    means.append(m)
-                    sem = d.sem()
-                    errs.append(sem)
-                    D_J.append(d.values)
-                D_J = np.stack(D_J, axis=1)
-
-                b = np.linalg.lstsq(np.stack([np.ones_like(means), length2x(clens)], axis=1), D_J.T)[0]
-                NLenJ = b[1]
-                xline = np.linspace(plot_basis.min(), plot_basis.max(), 500)
-                X = np.stack([np.ones_like(xline), xline], axis=1)
-                yline = np.dot(X, b).mean(axis=-1)
-
-                plt.errorbar(
-                    [0, 3, 5],
-                    means,
-                    yerr=errs,
-                    fmt='bs',
-                    linestyle='none',
-                    ecolor='blue',
-                    lw=2,
-                    capsize=0,
-                    label='normal'
-                )
-                plt.plot(
-                    xline,
-                    yline,
-                    linestyle='dashed',
-                    color='blue'
-                )
-
-                _df = df[df.StimType == 'N']
-                clens = [3, 4]
-                means = []
-                errs = []
-                D_N = []
-                for i, clen in enumerate(clens):
-                    d = _df[(_df.nlength == clen) & (_df.ROI == ROI)]
-                    d = d.sort_values('Subject')
-                    d = d.EffectSize
-                    m = d.mean()
-                    means.append(m)
-                    sem = d.sem()
-                    errs.append(sem)
-                    D_N.append(d.values)
-                D_N = np.stack(D_N, axis=1)
-
-                b = np.linalg.lstsq(np.stack([np.ones_like(means), length2x(clens)], axis=1), D_N.T)[0]
-                NLenN = b[1]
-
-                xline = np.linspace(plot_basis.min(), plot_basis.max(), 500)
-                X = np.stack([np.ones_like(xline), xline], axis=1)
-                yline = np.dot(X, b).mean(axis=-1)
-
-                plt.errorbar(
-                    [2, 3],
-                    means,
-                    yerr=errs,
-                    fmt='mx',
-                    linestyle='none',
-                    ecolor='m',
-                    lw=2,
-                    capsize=0,
-                    label='normal'
-                )
-                plt.plot(
-                    xline,
-                    yline,
-                    linestyle='dashed',
-                    color='m'
-                )
-
-            else:
-                D_J = NLenJ = D_N = NLenN = None
-
-            plt.subplots_adjust(left=0.3)
-            plt.xlim(plot_basis.min() - 0.2, plot_basis.max() + 0.2)
-
-            plt.xticks(xtick_pos, labels=xtick_labels)
-            plt.gcf().set_size_inches((2, 3))
-
-            for ylim_key in ylims:
-                print(ylim_key)
-                ylim = ylims[ylim_key]
-                plt.ylim(ylim)
-                plt.savefig(os.path.join('plots', '%s_nlength%s_%s_plot%s.png' % (parcel_set, experiment, ROI, ylim_key)), dpi=300)
-            plt.close('all')
-
-            # Contrasts
-            columns = ['C%02d' % x for x in lengths]
-            if experiment == 2:
-                columns += ['J%02d' % x for x in [1, 4, 12]] + ['N%02d' % x for x in [3, 4]]
-
-            _out = [D_C]
-            if experiment == 2:
-                _out += [D_J, D_N]
-            _out = pd.DataFrame(np.concatenate(_out, axis=1), columns=columns)
-            _out['Subject'] = subjects
-            _out['fROI'] = ROI
-
-            C = np.dot(D_C, np.ones_like(plot_basis) / 6.)
-            if experiment == 2:
-                C1412 = np.dot(D_C, [0.333, 0, 0, 0.333, 0, 0.333])
-                C126 = np.dot(D_C, [0.33, 0.33, 0, 0, 0.33, 0])
-                C34 = np.dot(D_C, [0, 0, 0.5, 0.5, 0, 0])
-                J = np.dot(D_J, [0.333, 0.333, 0.333])
-                N = np.dot(D_N, [0.5, 0.5])
-            else:
-                C1412 = np.dot(D_C, [0.333, 0, 0.333, 0, 0.333])
-                C126 = np.dot(D_C, [0.33, 0.33, 0, 0.33, 0])
-                C34 = J = N = None
-
-            S_v_W = D_C[:,-1] - D_C[:,0]
-            if experiment == 2:
-                S_v_N = D_C[:,-1] - D_J[:,0]
-                J_v_W = D_J[:,-1] - D_C[:,0]
-                J_v_N = D_J[:,-1] - D_J[:,0]
-                S_v_W_v_J_v_N = S_v_W - J_v_N
-            else:
-                S_v_N = J_v_W = J_v_N = S_v_W_v_J_v_N = None
-
-            _out['C'] = C
-            _out['C1412'] = C1412
-            _out['C126'] = C126
-            if experiment == 2:
-                _out['C34'] = C34
-                _out['N'] = N
-                _out['J'] = J
-                _out['C_v_J'] = C1412 - J
-                _out['C_v_N'] = C34 - N
-
-            _out['NLenC'] = NLenC
-            if experiment == 2:
-                _out['NLenJ'] = NLenJ
-                _out['NLenN'] = NLenN
-
-                _out['NLenC_v_NLenJ'] = NLenC - NLenJ
-                _out['NLenC_v_NLenN'] = NLenC - NLenN
-                _out['NLenJ_v_NLenN'] = NLenJ - NLenN
-
-            _out['S_v_W'] = S_v_W
-            if experiment == 2:
-                _out['S_v_N'] = S_v_N
-                _out['J_v_W'] = J_v_W
-                _out['J_v_N'] = J_v_N
-                _out['S_v_W_v_J_v_N'] = S_v_W_v_J_v_N
-
-            out.append(_out)
-
-        out = pd.concat(out, axis=0)
-        out.to_csv(os.path.join('contrasts', '%s_nlength%s_contrasts.csv' % (parcel_set, experiment)), index=False)
-
-
-    # 6 words experiment
-
-    paths = [
-        os.path.join(base_path, 'main', '6words_n20', parcel_set_path, 'mROI_6wordsEFFECT_langLOC',
-                     'spm_ss_mROI_data.details.EffectSize.csv'),
-        os.path.join(base_path, 'main', '6words_n20', parcel_set_path, 'mROI_6wordsEFFECT_aliceLOC',
-                     'spm_ss_mROI_data.details.EffectSize.csv'),
-    ]
-    lengths = [1, 2, 3, 4, 5, 6, 8, 10, 12]
-    wl24_lengths = [1, 2, 3, 4, 6, 8, 12]
-    wl24_plot_basis = length2x(wl24_lengths)
-    wl30_lengths = [1, 2, 3, 5, 6, 10]
-    wl30_plot_basis = length2x(wl30_lengths)
-
-    xtick_pos = length2x(lengths)
-    xtick_labels = [str(x) for x in lengths]
-
-    df = [pd.read_csv(path) for path in paths]
-    df = pd.concat(df, axis=0)
-
-    plot_path = 'plots'
-    contrast_path = 'contrasts'
-
-    df.ROI = df.ROI.apply(lambda x: fROIs[parcel_set][x - 1])
-    df = df[df.ROI.isin(networks[parcel_set])]
-    df = df[~df.Effect.str.contains('-')]
-    df['StimType'] = np.zeros_like(df.Effect)
-    df.StimType[df.Effect.str.contains('jab')] = 'J'
-    df.StimType[df.Effect.str.contains('nc')] = 'N'
-    df.StimType[(~df.Effect.str.contains('nc')) & (~df.Effect.str.contains('jab'))] = 'C'
-    df['nlength'] = df.Effect.str.extract('_?(\d+)[_cnj]').astype(int)
-    df['experiment'] = df.Effect.apply(lambda x: '6words' if 'wl' in x else 'nlength')
-
-    out = []
-
-    for ROI in networks[parcel_set]:
-        # Plot
-        plt.gca().spines['top'].set_visible(False)
-        plt.gca().spines['right'].set_visible(False)
-        plt.gca().spines['bottom'].set_visible(False)
-        plt.gca().spines['left'].set_visible(True)
-        plt.gca().tick_params(labelleft='on', labelbottom='on')
-        plt.gca().yaxis.set_ticks_position('left')
-        plt.gca().xaxis.set_ticks_position('none')
-        plt.gca().axhline(y=0, lw=1, c='gray', alpha=1)
-
-        # 24 word list
-        _df = df[df.Effect.str.endswith('24wl')]
-        clens = wl24_lengths
-        plot_basis = wl24_plot_basis
-        means = []
-        errs = []
-        D_WL24 = []
-        subjects = None
-        for i, clen in enumerate(clens):
-            d = _df[(_df.nlength == clen) & (_df.ROI == ROI)]
-            if len(d.values):
-                d = d.sort_values('Subject')
-                if subjects is None:
-                    subjects = d.Subject.values
-                d = d.EffectSize
-                m = d.mean()
-                means.append(m)
-                sem = d.sem()
-                errs.append(sem)
-                D_WL24.append(d.values)
-        D_WL24 = np.stack(D_WL24, axis=1)
-
-        b = np.linalg.lstsq(np.stack([np.ones_like(means), plot_basis], axis=1), D_WL24.T)[0]
-        NLen24WL = b[1]
-
-        xline = np.linspace(0, length2x(12), 500)
-        X = np.stack([np.ones_like(xline), xline], axis=1)
-        yline = np.dot(X, b).mean(axis=-1)
-
-        plt.errorbar(
-            plot_basis,
-            means,
-            yerr=errs,
-            fmt='gv',
+    return ylims
+
+
+def get_nlength_lengths(experiment):
+    if experiment == 1:
+        return [1, 2, 4, 6, 12]  # Length 3 condition missing
+    return [1, 2, 3, 4, 6, 12]
+
+
+def map_rois(df, parcel_set):
+    df = df.assign(ROI=np.array(fROIs[parcel_set])[df.ROI.values - 1])
+    return df[df.ROI.isin(networks[parcel_set])]
+
+
+def prepare_nlength(df, parcel_set, experiment):
+    if experiment == 1:
+        df = df[df.Subject != '430_FED_20170523b_3T2_PL2017']  # Drop repeated session by subject 430
+
+    df = map_rois(df, parcel_set)
+    labels = decode_effects(df.Effect)
+    keep = ~labels.is_contrast.values
+    df = df[keep].assign(Condition=labels.condition.values[keep])
+
+    return df
+
+
+def prepare_6words(df, parcel_set):
+    df = map_rois(df, parcel_set)
+    labels = decode_effects(df.Effect)
+    keep = ~labels.is_contrast.values & labels.wordlist.notna().values
+    df = df[keep].assign(Condition=labels.condition.values[keep])
+
+    return df
+
+
+def nlength_contrasts(experiment, lengths):
+    C = {'C%02d' % x: 1. / 6 for x in lengths}
+    C1412 = {'C01': 0.333, 'C04': 0.333, 'C12': 0.333}
+    C126 = {'C01': 0.33, 'C02': 0.33, 'C06': 0.33}
+    S_v_W = {'C12': 1., 'C01': -1.}
+    contrasts = {
+        'C': C,
+        'C1412': C1412,
+        'C126': C126,
+        'S_v_W': S_v_W,
+    }
+    if experiment == 2:
+        C34 = {'C03': 0.5, 'C04': 0.5}
+        J = {'J01': 0.333, 'J04': 0.333, 'J12': 0.333}
+        N = {'N03': 0.5, 'N04': 0.5}
+        J_v_N = {'J12': 1., 'J01': -1.}
+        contrasts.update({
+            'C34': C34,
+            'N': N,
+            'J': J,
+            'C_v_J': combine((1, C1412), (-1, J)),
+            'C_v_N': combine((1, C34), (-1, N)),
+            'S_v_N': {'C12': 1., 'J01': -1.},
+            'J_v_W': {'J12': 1., 'C01': -1.},
+            'J_v_N': J_v_N,
+            'S_v_W_v_J_v_N': combine((1, S_v_W), (-1, J_v_N)),
+        })
+
+    return contrasts
+
+
+def sixwords_contrasts():
+    wl24 = ['C%02d_WL24' % x for x in WL24_LENGTHS]
+    wl30 = ['C%02d_WL30' % x for x in WL30_LENGTHS]
+    n = len(wl24) + len(wl30)
+    return {
+        'C_WL24': {c: 1. / len(wl24) for c in wl24},
+        'C_WL30': {c: 1. / len(wl30) for c in wl30},
+        'C_6words': {c: 1. / n for c in wl24 + wl30},
+        'C126_6words': {c: 0.166 for c in ['C01_WL24', 'C02_WL24', 'C06_WL24', 'C01_WL30', 'C02_WL30', 'C06_WL30']},
+    }
+
+
+def fit_length(D, lengths):
+    # Intercept, slope and residual variance of effect size over the length basis, for every subject and fROI
+    return fit_slopes(D, length2x(lengths))
+
+
+def to_frame(X, subjects, rois, conditions, values, columns):
+    # Flatten [subject, fROI, ...] arrays into the fROI-major long table written to contrasts/
+    n_subj, n_roi = X.shape[:2]
+    out = pd.DataFrame(X.transpose(1, 0, 2).reshape(-1, len(conditions)), columns=conditions)
+    out['Subject'] = np.tile(subjects, n_roi)
+    out['fROI'] = np.repeat(rois, n_subj)
+    for col in columns:
+        out[col] = values[col].T.reshape(-1)
+    return out
+
+
+def setup_axes(ax):
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['bottom'].set_visible(False)
+    ax.spines['left'].set_visible(True)
+    ax.tick_params(labelleft='on', labelbottom='on')
+    ax.yaxis.set_ticks_position('left')
+    ax.xaxis.set_ticks_position('none')
+    # ax.grid(b=True, which='major', axis='y', ls='--', lw=.5, c='k', alpha=.3)
+    ax.axhline(y=0, lw=1, c='gray', alpha=1)
+
+
+def fit_series(x, D, fit, r, xline, fmt, color, ci=None):
+    # Condition means, error bars and the subject-averaged regression line for fROI r, ready to render.
+    # Error bars are SEMs, or bootstrap intervals if ci gives the mean_ci options.
+    D = D[:, r]
+    if ci is None:
+        err = nansem(D, axis=0)
+    else:
+        mean, lower, upper = mean_ci(D, **ci)
+        err = np.stack([mean - lower, upper - mean])
+    return {
+        'x': x,
+        'mean': np.nanmean(D, axis=0),
+        'err': err,
+        'xline': xline,
+        'yline': fit.intercept[:, r].mean() + fit.slope[:, r].mean() * xline,
+        'fmt': fmt,
+        'color': color
+    }
+
+
+def render_plot(spec):
+    # Draw one per-fROI length plot on a private Agg canvas and save it once per y-limit
+    fig = Figure(figsize=(2, 3))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    setup_axes(ax)
+    for series in spec['series']:
+        ax.errorbar(
+            series['x'],
+            series['mean'],
+            yerr=series['err'],
+            fmt=series['fmt'],
             linestyle='none',
-            ecolor='green',
+            ecolor=series['color'],
             lw=2,
             capsize=0,
             label='normal'
         )
-        plt.plot(
-            xline,
-            yline,
+        ax.plot(
+            series['xline'],
+            series['yline'],
             linestyle='dashed',
-            color='green',
+            color=series['color'],
         )
 
-        # 30 word list
-        _df = df[df.Effect.str.endswith('30wl')]
-        clens = wl30_lengths
-        plot_basis = wl30_plot_basis
-        means = []
-        errs = []
-        D_WL30 = []
-        subjects = None
-        for i, clen in enumerate(clens):
-            d = _df[(_df.nlength == clen) & (_df.ROI == ROI)]
-            if len(d.values):
-                d = d.sort_values('Subject')
-                if subjects is None:
-                    subjects = d.Subject.values
-                d = d.EffectSize
-                m = d.mean()
-                means.append(m)
-                sem = d.sem()
-                errs.append(sem)
-                D_WL30.append(d.values)
-        D_WL30 = np.stack(D_WL30, axis=1)
-
-        b = np.linalg.lstsq(np.stack([np.ones_like(means), plot_basis], axis=1), D_WL30.T)[0]
-        NLen30WL = b[1]
+    fig.subplots_adjust(left=0.3)
+    ax.set_xlim(spec['xlim'])
+    ax.set_xticks(spec['xticks'], labels=spec['xticklabels'])
+
+    for path, ylim in spec['outputs']:
+        ax.set_ylim(ylim)
+        fig.savefig(path, dpi=300)
+
+
+def render_plots(specs, jobs=1):
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(render_plot, specs, chunksize=max(1, len(specs) // (jobs * 4))))
+    else:
+        for spec in specs:
+            render_plot(spec)
+
+
+def run_nlength(df, parcel_set, experiment, save_contrasts=True, plots=True, ci=None):
+    ylims = get_ylims(parcel_set)
+    lengths = get_nlength_lengths(experiment)
+    plot_basis = length2x(lengths)
+
+    rois = networks[parcel_set]
+    c_conditions = ['C%02d' % x for x in lengths]
+    j_conditions = ['J%02d' % x for x in J_LENGTHS]
+    n_conditions = ['N%02d' % x for x in N_LENGTHS]
+    conditions = c_conditions
+    if experiment == 2:
+        conditions = conditions + j_conditions + n_conditions
+
+    df = prepare_nlength(df, parcel_set, experiment)
+    X, subjects = pivot_effects(df, rois, conditions)
+    D_C = X[..., :len(c_conditions)]
+    D_J = X[..., len(c_conditions):len(c_conditions) + len(j_conditions)]
+    D_N = X[..., len(c_conditions) + len(j_conditions):]
+
+    fit_C = fit_length(D_C, lengths)
+    if experiment == 2:
+        fit_J = fit_length(D_J, J_LENGTHS)
+        fit_N = fit_length(D_N, N_LENGTHS)
+
+    if save_contrasts:
+        values = apply_contrasts(X, conditions, nlength_contrasts(experiment, lengths))
+        values['NLenC'] = fit_C.slope
+        if experiment == 2:
+            values['NLenJ'] = fit_J.slope
+            values['NLenN'] = fit_N.slope
+            values['NLenC_v_NLenJ'] = values['NLenC'] - values['NLenJ']
+            values['NLenC_v_NLenN'] = values['NLenC'] - values['NLenN']
+            values['NLenJ_v_NLenN'] = values['NLenJ'] - values['NLenN']
+
+        out = to_frame(X, subjects, rois, conditions, values, NLENGTH_COLUMNS[experiment])
+        out.to_csv(os.path.join('contrasts', '%s_nlength%s_contrasts.csv' % (parcel_set, experiment)), index=False)
 
+    specs = []
+    if plots:
+        xline = np.linspace(plot_basis.min(), plot_basis.max(), 500)
+        for r, ROI in enumerate(rois):
+            series = [fit_series(plot_basis, D_C, fit_C, r, xline, 'ro', 'red', ci=ci)]
+            if experiment == 2:
+                series.append(fit_series(length2x(J_LENGTHS), D_J, fit_J, r, xline, 'bs', 'blue', ci=ci))
+                series.append(fit_series(length2x(N_LENGTHS), D_N, fit_N, r, xline, 'mx', 'm', ci=ci))
+            specs.append({
+                'series': series,
+                'xlim': (plot_basis.min() - 0.2, plot_basis.max() + 0.2),
+                'xticks': plot_basis,
+                'xticklabels': [str(x) for x in lengths],
+                'outputs': [(os.path.join('plots', '%s_nlength%s_%s_plot%s.png' % (parcel_set, experiment, ROI, ylim_key)),
+                             ylims[ylim_key]) for ylim_key in ylims]
+            })
+
+    return specs
+
+
+def run_6words(df, parcel_set, save_contrasts=True, plots=True, ci=None):
+    ylims = get_ylims(parcel_set)
+    wl24_plot_basis = length2x(WL24_LENGTHS)
+    wl30_plot_basis = length2x(WL30_LENGTHS)
+
+    rois = networks[parcel_set]
+    wl24_conditions = ['C%02d_WL24' % x for x in WL24_LENGTHS]
+    wl30_conditions = ['C%02d_WL30' % x for x in WL30_LENGTHS]
+    conditions = wl24_conditions + wl30_conditions
+
+    df = prepare_6words(df, parcel_set)
+    X, subjects = pivot_effects(df, rois, conditions)
+    D_WL24 = X[..., :len(wl24_conditions)]
+    D_WL30 = X[..., len(wl24_conditions):]
+
+    fit_WL24 = fit_length(D_WL24, WL24_LENGTHS)
+    fit_WL30 = fit_length(D_WL30, WL30_LENGTHS)
+
+    if save_contrasts:
+        values = apply_contrasts(X, conditions, sixwords_contrasts())
+        values['NLen24WL'] = fit_WL24.slope
+        values['NLen30WL'] = fit_WL30.slope
+        values['NLen6words'] = fit_length(X, WL24_LENGTHS + WL30_LENGTHS).slope
+
+        columns = ['C_WL24', 'C_WL30', 'C_6words', 'C126_6words', 'NLen24WL', 'NLen30WL', 'NLen6words']
+        out = to_frame(X, subjects, rois, conditions, values, columns)
+        out.to_csv(os.path.join('contrasts', '%s_6words_contrasts.csv' % parcel_set), index=False)
+
+    specs = []
+    if plots:
         xline = np.linspace(0, length2x(12), 500)
-        X = np.stack([np.ones_like(xline), xline], axis=1)
-        yline = np.dot(X, b).mean(axis=-1)
-
-        plt.errorbar(
-            plot_basis,
-            means,
-            yerr=errs,
-            fmt='c^',
-            linestyle='none',
-            ecolor='c',
-            lw=2,
-            capsize=0,
-            label='normal'
-        )
-        plt.plot(
-            xline,
-            yline,
-            linestyle='dashed',
-            color='c',
-        )
-
-        C_WL24 = np.dot(D_WL24, np.ones_like(wl24_lengths) / len(wl24_lengths))
-        C_WL30 = np.dot(D_WL30, np.ones_like(wl30_lengths) / len(wl30_lengths))
-        X = np.concatenate([D_WL24, D_WL30], axis=1)
-        ncol = X.shape[1]
-        C_6words = np.dot(X, np.ones(ncol) / ncol)
-        C126_6words = np.dot(X, [0.166, 0.166, 0, 0, 0.166, 0, 0, 0.166, 0.166, 0, 0, 0.166, 0])
-        steps = length2x(wl24_lengths + wl30_lengths)
-        b = np.linalg.lstsq(np.stack([np.ones(ncol), steps], axis=1), X.T)[0]
-        NLen6words = b[1]
-
-        plt.subplots_adjust(left=0.3)
-        plt.xticks(length2x([1, 2, 3, 4, 6, 12]), ['1', '2', '3', '4', '6', '12'])
-        plt.xlim(-0.2, length2x(12) + 0.2)
-        plt.gcf().set_size_inches((2, 3))
-
-        for ylim_key in ylims:
-            ylim = ylims[ylim_key]
-            plt.ylim(ylim)
-            plt.savefig(os.path.join('plots', '%s_6words_%s_plot%s.png' % (parcel_set, ROI, ylim_key)), dpi=300)
-        plt.close('all')
-
-        columns = ['C%02d_WL24' % x for x in wl24_lengths]
-        columns += ['C%02d_WL30' % x for x in wl30_lengths]
-
-        _out = pd.DataFrame(np.concatenate([D_WL24, D_WL30], axis=1), columns=columns)
-        _out['Subject'] = subjects
-        _out['fROI'] = ROI
-
-
-        _out['C_WL24'] = C_WL24
-        _out['C_WL30'] = C_WL30
-        _out['C_6words'] = C_6words
-        _out['C126_6words'] = C126_6words
-        _out['NLen24WL'] = NLen24WL
-        _out['NLen30WL'] = NLen30WL
-        _out['NLen6words'] = NLen6words
+        for r, ROI in enumerate(rois):
+            specs.append({
+                'series': [
+                    fit_series(wl24_plot_basis, D_WL24, fit_WL24, r, xline, 'gv', 'green', ci=ci),
+                    fit_series(wl30_plot_basis, D_WL30, fit_WL30, r, xline, 'c^', 'c', ci=ci),
+                ],
+                'xlim': (-0.2, length2x(12) + 0.2),
+                'xticks': length2x([1, 2, 3, 4, 6, 12]),
+                'xticklabels': ['1', '2', '3', '4', '6', '12'],
+                'outputs': [(os.path.join('plots', '%s_6words_%s_plot%s.png' % (parcel_set, ROI, ylim_key)),
+                             ylims[ylim_key]) for ylim_key in ylims]
+            })
+
+    return specs
+
+
+def get_units():
+    # Independent (parcel_set, experiment) jobs, each with its own inputs and outputs
+    units = []
+    for parcel_set in parcel_set_map:
+        for experiment in experiments:
+            units.append((parcel_set, experiment))
+        units.append((parcel_set, '6words'))
+    return units
+
+
+def run_unit(df, parcel_set, experiment, save_contrasts=True, plots=True, ci=None):
+    # Returns wall time and the unit's plot specs for the deferred render queue
+    t0 = time.time()
+    if experiment == '6words':
+        specs = run_6words(df, parcel_set, save_contrasts=save_contrasts, plots=plots, ci=ci)
+    else:
+        specs = run_nlength(df, parcel_set, experiment, save_contrasts=save_contrasts, plots=plots, ci=ci)
+    return time.time() - t0, specs
+
+
+def report_unit(parcel_set, experiment, t):
+    name = experiment if experiment == '6words' else 'nlength%s' % experiment
+    sys.stderr.write('%s_%s: %.2fs\n' % (parcel_set, name, t))
+    sys.stderr.flush()
 
-        out.append(_out)
 
-    out = pd.concat(out, axis=0)
-    out.to_csv(os.path.join('contrasts', '%s_6words_contrasts.csv' % parcel_set), index=False)
+def main():
+    argparser = argparse.ArgumentParser('''
+    Compute contrast estimates and per-fROI plots for all parcel sets and experiments.
+    ''')
+    argparser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes.')
+    argparser.add_argument('--no-plots', action='store_true', help='Only compute the contrast tables.')
+    argparser.add_argument('--plots-only', action='store_true', help='Only render the per-fROI plots.')
+    argparser.add_argument('--ci', default='sem', choices=['sem'] + CI_METHODS, help='Error bars: SEM or bootstrap interval type.')
+    argparser.add_argument('--n_boot', type=int, default=10000, help='Number of bootstrap resamples.')
+    argparser.add_argument('--seed', type=int, default=None, help='Random seed for the bootstrap.')
+    args = argparser.parse_args()
+    if args.no_plots and args.plots_only:
+        argparser.error('--no-plots and --plots-only are mutually exclusive.')
+    save_contrasts = not args.plots_only
+    plots = not args.no_plots
+    ci = None if args.ci == 'sem' else {'method': args.ci, 'n_boot': args.n_boot, 'seed': args.seed}
+
+    base_path = get_base_path()
+
+    for path in ('plots', 'contrasts'):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    t0 = time.time()
+    units = get_units()
+
+    # Read every distinct source file once; each unit only receives its own network's ROI rows
+    sources = {unit: unit_sources(base_path, *unit) for unit in units}
+    plan = LoadPlan()
+    for unit in units:
+        plan.add(sources[unit])
+    plan.load()
+    inputs = {unit: plan.get(sources[unit], rois=network_rois(unit[0])) for unit in units}
+    sys.stderr.write('Loaded %d distinct input files for %d units: %.2fs\n' % (len(plan.paths), len(units), time.time() - t0))
+
+    render_queue = []
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = {pool.submit(run_unit, inputs[unit], *unit, save_contrasts=save_contrasts, plots=plots, ci=ci): unit
+                       for unit in units}
+            results = {}
+            for future in as_completed(futures):
+                t, specs = future.result()
+                report_unit(*futures[future], t)
+                results[futures[future]] = specs
+        for unit in units:
+            render_queue += results[unit]
+    else:
+        for unit in units:
+            t, specs = run_unit(inputs[unit], *unit, save_contrasts=save_contrasts, plots=plots, ci=ci)
+            report_unit(*unit, t)
+            render_queue += specs
+
+    if render_queue:
+        t1 = time.time()
+        render_plots(render_queue, jobs=args.jobs)
+        sys.stderr.write('Rendered %d plots: %.2fs\n' % (len(render_queue), time.time() - t1))
+    sys.stderr.write('Total: %.2fs\n' % (time.time() - t0))
+    sys.stderr.flush()
 
 
+if __name__ == '__main__':
+    main()
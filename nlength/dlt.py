@@ -0,0 +1,232 @@
+import re
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from nlength.tree import Tree
+from nlength.measures import LINETREES, ITEMMEASURES, agreement
+
+
+# c: later conjuncts attach to the first one; v: verbs weigh more as referents; m: no cost for modifiers
+# that precede their head
+DLT_VARIANTS = ['dlt', 'dltc', 'dltv', 'dltm', 'dltcv', 'dltcm', 'dltvm', 'dltcvm']
+PRONOUNS = {
+    'i', 'me', 'myself', 'you', 'yourself', 'he', 'him', 'himself', 'she', 'her', 'herself', 'it', 'itself',
+    'we', 'us', 'ourselves', 'they', 'them', 'themselves', 'oneself', 'who', 'whom', 'which', 'that'
+}
+REFERENT = {'N': 1, 'V': 1}
+REFERENT_V = {'N': 1, 'V': 2, 'Vnon': 1}
+OPERATOR = re.compile('-l([A-Z])$')
+
+# which head scheme a dependency belongs to
+BOTH = 0
+BASE = 1
+CHAIN = 2
+
+
+def pos_tag(cat, word):
+    # Coarse part of speech of a preterminal, as in the itemmeasures pos column
+    if word.lower() in PRONOUNS:
+        return 'pronoun'
+    m = re.match('[A-Za-z]+', cat)
+    c = m.group() if m else ''
+    if c == 'N':
+        return 'D' if cat.startswith('N-b{N-aD}') else 'N'
+    if c in ('B', 'G', 'L'):
+        return 'Vnon'
+    if c in ('A', 'D', 'R', 'V', 'X'):
+        return c
+    return 'O'
+
+
+def operator(cat):
+    m = OPERATOR.search(cat)
+    return m.group(1) if m else ''
+
+
+def dependencies(t):
+    # Words, part-of-speech tags and head-dependent pairs of a GCG tree, in one postorder pass without
+    # recursion. In each binary node the child without an -l operator is the head and the other its
+    # dependent (A argument, M modifier, C conjunct, N non-local); determiners and conjunctions pass headship
+    # to their argument. Heads are kept under two schemes: a coordination is headed by all of its conjuncts
+    # (BASE) or by the first one, to which the others attach (CHAIN). Fronted non-local dependents (relative
+    # pronouns, topicalized phrases) are integrated at their gap rather than at the clause head, so they add
+    # no pair. Returns the words, tags and a list of (head, dependent, kind, scheme).
+    words = []
+    tags = []
+    deps = []
+    heads = {}
+    stack = [(t, False)]
+    while stack:
+        n, done = stack.pop()
+        if not done:
+            if not n.ch or (len(n.ch) == 1 and not n.ch[0].ch):
+                word = n.ch[0].c if n.ch else n.c
+                i = [len(words)]
+                words.append(word)
+                tags.append(pos_tag(n.c if n.ch else '', word))
+                heads[id(n)] = (i, i, tags[-1])
+                continue
+            if len(n.ch) > 2:
+                raise ValueError('Non-binary tree. %s' % t)
+            stack.append((n, True))
+            for ch in reversed(n.ch):
+                stack.append((ch, False))
+            continue
+
+        if len(n.ch) == 1:
+            heads[id(n)] = heads.pop(id(n.ch[0]))
+            continue
+
+        a, b = n.ch
+        oa, ob = operator(a.c), operator(b.c)
+        if not oa:
+            head, dep, kind = a, b, ob
+        elif not ob or oa == 'M' or ob != 'M':
+            head, dep, kind = b, a, oa
+        else:
+            head, dep, kind = a, b, ob
+        H, Hc, tag = heads.pop(id(head))
+        D, Dc, _ = heads.pop(id(dep))
+        if tag == 'X' and not kind:
+            kind = 'C'
+
+        if kind == 'N' and dep is a:
+            base, chain = H, Hc
+        elif kind == 'C':
+            if dep is a:
+                # first conjunct and the rest of the coordination
+                base = D + H
+                deps += [(x, y, kind, CHAIN) for x in Dc for y in Hc]
+            else:
+                # conjunction (or earlier conjunct) and the next conjunct
+                base = D if tag == 'X' else H + D
+                if tag == 'X':
+                    deps.append((H[0], D[0], kind, BASE))
+            chain = Dc
+        elif tag in ('D', 'X') and kind == 'A':
+            if H is Hc and D is Dc:
+                deps += [(H[0], y, kind, BOTH) for y in D]
+            else:
+                deps += [(H[0], y, kind, BASE) for y in D] + [(Hc[0], y, kind, CHAIN) for y in Dc]
+            base, chain = D, Dc
+        else:
+            if H is Hc and D is Dc:
+                deps += [(x, y, kind, BOTH) for x in H for y in D]
+            else:
+                deps += [(x, y, kind, BASE) for x in H for y in D] + [(x, y, kind, CHAIN) for x in Hc for y in Dc]
+            base, chain = H, Hc
+        heads[id(n)] = (base, chain, None)
+
+    return words, tags, deps
+
+
+def dlt_costs(tags, deps):
+    # Integration costs of every variant for words with the given tags and (head, dependent, kind, scheme)
+    # pairs (word indices may span several sentences). Running referent counts (prefix sums) give the number
+    # of new discourse referents strictly between the two ends of each pair, which is charged to the later
+    # word on top of its own referent cost.
+    n = len(tags)
+    ref = np.array([REFERENT.get(x, 0) for x in tags], dtype=float)
+    ref_v = np.array([REFERENT_V.get(x, 0) for x in tags], dtype=float)
+    if deps:
+        head, dep, kind, scheme = [np.array(x) for x in zip(*deps)]
+    else:
+        head = dep = scheme = np.zeros(0, dtype=int)
+        kind = np.zeros(0, dtype=str)
+    early = np.minimum(head, dep)
+    late = np.maximum(head, dep)
+    premod = (kind == 'M') & (dep < head)
+
+    out = {}
+    for weights in (ref, ref_v):
+        cum = np.concatenate([[0.], np.cumsum(weights)])
+        dist = cum[late] - cum[early + 1]
+        for chain in (False, True):
+            for m in (False, True):
+                use = (scheme == BOTH) | (scheme == (CHAIN if chain else BASE))
+                if m:
+                    use &= ~premod
+                name = 'dlt' + 'c' * chain + 'v' * (weights is ref_v) + 'm' * m
+                out[name] = weights + np.bincount(late[use], weights=dist[use], minlength=n)
+    return {x: out[x].astype(int) for x in DLT_VARIANTS}
+
+
+def tree_costs(t):
+    words, tags, deps = dependencies(t)
+    return dlt_costs(tags, deps)
+
+
+def run_chunk(lines, start=0):
+    # DLT costs for a chunk of linetrees starting at line start, one row per word. sentid is the line number
+    # of the tree, so blank lines produce no rows but are still counted.
+    words = []
+    tags = []
+    deps = []
+    sentid = []
+    sentpos = []
+    for i, line in enumerate(lines, start):
+        if not line.strip():
+            continue
+        t = Tree()
+        t.read(line)
+        _words, _tags, _deps = dependencies(t)
+        k = len(words)
+        deps += [(x + k, y + k, kind, scheme) for x, y, kind, scheme in _deps]
+        words += _words
+        tags += _tags
+        sentid += [i] * len(_words)
+        sentpos += list(range(1, len(_words) + 1))
+    out = pd.DataFrame({'word': words, 'sentid': sentid, 'sentpos': sentpos, 'pos': tags})
+    for x, y in dlt_costs(tags, deps).items():
+        out[x] = y
+    return out
+
+
+def dlt_table(lines, jobs=1, chunk_size=1000):
+    # DLT costs for every word of the linetrees, computed over chunks of sentences by a pool of workers
+    offsets = list(range(0, len(lines), chunk_size))
+    chunks = [lines[i:i + chunk_size] for i in offsets]
+    if jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            out = list(pool.map(run_chunk, chunks, offsets))
+    else:
+        out = [run_chunk(x, i) for x, i in zip(chunks, offsets)]
+    if not out:
+        return run_chunk([])
+    return pd.concat(out, axis=0, ignore_index=True)
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Compute Dependency Locality Theory integration costs (all dlt* variants) for every word of a linetrees file
+    and save them as an itemmeasures-style (space-delimited) table.
+    ''')
+    argparser.add_argument('-t', '--linetrees', default=LINETREES, help='Path to the trees, one per line.')
+    argparser.add_argument('-o', '--output', default='ling_preds/conlenc.gold.dlt', help='Path to the output table.')
+    argparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of worker processes (default: all cores).')
+    argparser.add_argument('--chunk_size', type=int, default=1000, help='Sentences per worker task.')
+    argparser.add_argument('-c', '--compare', nargs='?', const=ITEMMEASURES, default=None, help='Report agreement with an itemmeasures file (default: the released one).')
+    args = argparser.parse_args()
+
+    t0 = time.time()
+    with open(args.linetrees, 'r') as f:
+        lines = f.readlines()
+    out = dlt_table(lines, jobs=args.jobs, chunk_size=args.chunk_size)
+    out.to_csv(args.output, sep=' ', index=False)
+    sys.stderr.write('Computed DLT costs for %d words (%d trees) in %.2fs\n' % (len(out), len(lines), time.time() - t0))
+
+    if args.compare:
+        rates, n = agreement(out, pd.read_csv(args.compare, sep=' '), columns=['pos'] + DLT_VARIANTS)
+        sys.stderr.write('Agreement with %s (%d words):\n' % (args.compare, n))
+        for x in rates:
+            sys.stderr.write('  %s: %.2f%%\n' % (x, rates[x] * 100))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import re
+import functools
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+
+EffectLabel = namedtuple(
+    'EffectLabel',
+    ['stim_type', 'length', 'wordlist', 'experiment', 'is_contrast', 'condition', 'swjn']
+)
+
+NLENGTH = re.compile(r'(\d+)')
+SIXWORDS = re.compile(r'_?(\d+)[_cnj]')
+SWJN = {
+    '12c': 'S',
+    '1c': 'W',
+    'jab12c': 'J',
+    'jab1c': 'N'
+}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_effect(label):
+    # Decode one spm_ss Effect label (e.g. 'S_jab4c', 'S_3nc', 'S_6c_24wl', 'S_12c-S_1c')
+    is_contrast = '-' in label
+    if 'jab' in label:
+        stim_type = 'J'
+    elif 'nc' in label:
+        stim_type = 'N'
+    else:
+        stim_type = 'C'
+
+    if label.endswith('24wl') or label.endswith('30wl'):
+        wordlist = 'WL' + label[-4:-2]
+        match = SIXWORDS.search(label)
+    else:
+        wordlist = None
+        match = NLENGTH.search(label)
+    experiment = '6words' if 'wl' in label else 'nlength'
+    length = int(match.group(1)) if match else None
+
+    if length is None:
+        condition = None
+    elif wordlist:
+        condition = 'C%02d_%s' % (length, wordlist)
+    else:
+        condition = '%s%02d' % (stim_type, length)
+
+    swjn = SWJN.get(label.split('_')[-1], label)
+
+    return EffectLabel(stim_type, length, wordlist, experiment, is_contrast, condition, swjn)
+
+
+def decode_effects(effects):
+    # Parse each distinct label once and broadcast the fields back to rows through category codes
+    effects = pd.Series(effects)
+    if isinstance(effects.dtype, pd.CategoricalDtype):
+        codes = effects.cat.codes.values
+        categories = effects.cat.categories
+    else:
+        codes, categories = pd.factorize(effects)
+    records = [parse_effect(x) for x in categories]
+
+    out = {}
+    for i, field in enumerate(EffectLabel._fields):
+        values = np.array([r[i] for r in records] + [None], dtype=object)
+        if field == 'is_contrast':
+            values = values.astype(bool)
+        out[field] = values[codes]
+
+    return pd.DataFrame(out, index=effects.index)
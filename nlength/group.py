@@ -0,0 +1,347 @@
+import sys
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats, optimize
+
+
+PARCEL_SETS = ['evlab', 'PDD', 'RH', 'PDDanat']
+EXPERIMENTS = ['nlength1', 'nlength2', '6words']
+
+CONTRASTS = {
+    'nlength1': [
+        'C',
+        'NLenC',
+        'S_v_W'
+    ],
+    'nlength2': [
+        'C',
+        'J',
+        'N',
+        'C_v_J',
+        'C_v_N',
+        'NLenC',
+        'NLenJ',
+        'NLenN',
+        'NLenC_v_NLenJ',
+        'NLenC_v_NLenN',
+        'NLenJ_v_NLenN',
+        'S_v_W',
+        'S_v_N',
+        'J_v_W',
+        'J_v_N',
+        'S_v_W_v_J_v_N'
+    ],
+    '6words': [
+        'C_WL24',
+        'C_WL30',
+        'C_6words',
+        'NLen24WL',
+        'NLen30WL',
+        'NLen6words'
+    ]
+}
+
+BETWEENGROUPS_CONTRASTS = [
+    'C6words_v_C1',
+    'C6words_v_C2',
+    'NLen6words_v_NLenC1',
+    'NLen6words_v_NLenC2'
+]
+
+HEMISPHERE_FROIS = ['IFGorb', 'IFG', 'MFG', 'AntTemp', 'PostTemp', 'AngG']
+
+RESULT_COLUMNS = ['parcel_set', 'experiment', 'contrast', 'fROI', 'model', 'n', 'conv', 'sing', 'beta', 'se', 't',
+                  'stat', 'df', 'p']
+
+
+def read_contrasts(parcel_set, experiment, contrast_path='contrasts'):
+    path = os.path.join(contrast_path, '%s_%s_contrasts.csv' % (parcel_set, experiment))
+    return pd.read_csv(path)
+
+
+def make_test(parcel_set, experiment, contrast, fROI, df, y, group=None):
+    # One full-vs-ablated comparison. fROI == 'all' pools fROIs with crossed random
+    # intercepts for Subject and fROI; otherwise the models are fixed-effects only.
+    # With a group column the full model adds an `experiment` slope, else an intercept.
+    df = df[np.isfinite(df[y].values)]
+    test = {
+        'parcel_set': parcel_set,
+        'experiment': experiment,
+        'contrast': contrast,
+        'fROI': fROI,
+        'y': df[y].values.astype(float),
+        'group': None if group is None else df[group].values.astype(float),
+    }
+    if fROI == 'all':
+        test['subject'] = pd.factorize(df.Subject)[0]
+        test['froi'] = pd.factorize(df.fROI)[0]
+    return test
+
+
+def collect_tests(contrast_path='contrasts'):
+    # Enumerate every model comparison of the group-level stage (cf. regress_l2.R)
+    tests = []
+    data = read_all_contrasts(contrast_path=contrast_path)
+    for parcel_set in PARCEL_SETS:
+        for experiment in EXPERIMENTS:
+            df = data[(parcel_set, experiment)]
+            for contrast in CONTRASTS[experiment]:
+                for fROI in ['all'] + list(df.fROI.unique()):
+                    _df = df if fROI == 'all' else df[df.fROI == fROI]
+                    tests.append(make_test(parcel_set, experiment, contrast, fROI, _df, contrast))
+
+    # Comparison between 6words and Nlength
+    for parcel_set in PARCEL_SETS:
+        df_exp3 = data[(parcel_set, '6words')]
+        for contrast in BETWEENGROUPS_CONTRASTS:
+            df = betweengroups_data(data, parcel_set, contrast)
+            for fROI in ['all'] + list(df_exp3.fROI.unique()):
+                _df = df if fROI == 'all' else df[df.fROI == fROI]
+                tests.append(make_test(parcel_set, 'betweengroups', contrast, fROI, _df, 'Effect', group='experiment'))
+
+    # Pairwise fROI comparison
+    df = data[('evlab', 'nlength2')]
+    pairs = [('NLenC_v_NLenJ', fROI_a, 'LPostTemp') for fROI_a in ('LIFG', 'LIFGorb')]
+    for source_contrast in ('NLenC', 'NLenJ', 'NLenC_v_NLenJ'):
+        for fROI_a in ('LIFGorb', 'LIFG', 'LMFG', 'LAntTemp', 'LPostTemp'):
+            pairs.append((source_contrast, fROI_a, 'LAngG'))
+    for source_contrast, fROI_a, fROI_b in pairs:
+        contrast = source_contrast + '_diff'
+        _df = diff_frois(df, source_contrast, fROI_a, fROI_b, contrast)
+        tests.append(make_test('evlab', 'nlength2', contrast, '%s_v_%s' % (fROI_a, fROI_b), _df, contrast))
+
+    # Laterality comparison
+    for experiment in EXPERIMENTS:
+        df = pd.concat([data[('evlab', experiment)], data[('RH', experiment)]], axis=0)
+        for source_contrast in CONTRASTS[experiment]:
+            contrast = source_contrast + '_diff'
+            pooled = []
+            for fROI in HEMISPHERE_FROIS:
+                _df = diff_frois(df, source_contrast, 'L' + fROI, 'R' + fROI, contrast).assign(fROI=fROI)
+                pooled.append(_df)
+                tests.append(make_test('betweenhemispheres', experiment, contrast, fROI, _df, contrast))
+            tests.append(make_test('betweenhemispheres', experiment, contrast, 'all', pd.concat(pooled, axis=0), contrast))
+
+    return tests
+
+
+def read_all_contrasts(contrast_path='contrasts'):
+    data = {}
+    for parcel_set in PARCEL_SETS:
+        for experiment in EXPERIMENTS:
+            data[(parcel_set, experiment)] = read_contrasts(parcel_set, experiment, contrast_path=contrast_path)
+    return data
+
+
+def betweengroups_data(data, parcel_set, contrast):
+    # Stack the 6words estimate (experiment=1) over the matching nlength estimate (experiment=0)
+    source_a = 'C126_6words' if contrast.startswith('C') else 'NLen6words'
+    source_b = 'NLenC' if 'NLen' in contrast else 'C126'
+    df_a = data[(parcel_set, '6words')]
+    df_b = data[(parcel_set, 'nlength1' if contrast.endswith('1') else 'nlength2')]
+    df_a = df_a[['Subject', 'fROI', source_a]].rename(columns={source_a: 'Effect'}).assign(experiment=1)
+    df_b = df_b[['Subject', 'fROI', source_b]].rename(columns={source_b: 'Effect'}).assign(experiment=0)
+    return pd.concat([df_a, df_b], axis=0)
+
+
+def diff_frois(df, source_contrast, fROI_a, fROI_b, contrast):
+    df_a = df[df.fROI == fROI_a][['Subject', source_contrast]]
+    df_b = df[df.fROI == fROI_b][['Subject', source_contrast]]
+    df = pd.merge(df_a, df_b, on='Subject', suffixes=('_a', '_b')).sort_values('Subject')
+    df[contrast] = df[source_contrast + '_a'] - df[source_contrast + '_b']
+    return df[['Subject', contrast]]
+
+
+def pad(columns):
+    # Stack ragged 1D arrays into a NaN-padded [max_n, k] matrix
+    out = np.full((max(len(x) for x in columns), len(columns)), np.nan)
+    for j, x in enumerate(columns):
+        out[:len(x), j] = x
+    return out
+
+
+def fit_intercept_tests(tests):
+    # y ~ 1 vs y ~ 0 for many tests at once. The F test of the nested lm's equals the squared t.
+    Y = pad([test['y'] for test in tests])
+    n = np.sum(np.isfinite(Y), axis=0)
+    beta = np.nanmean(Y, axis=0)
+    se = np.nanstd(Y, axis=0, ddof=1) / np.sqrt(n)
+    t = beta / se
+    p = 2 * stats.t.sf(np.abs(t), n - 1)
+    return [result_row(test, 'lm', n[j], beta[j], se[j], t[j], t[j] ** 2, 1, p[j]) for j, test in enumerate(tests)]
+
+
+def fit_group_tests(tests):
+    # Effect ~ experiment vs Effect ~ 1 (pooled-variance two-sample comparison) for many tests at once
+    Y = pad([test['y'] for test in tests])
+    G = pad([test['group'] for test in tests])
+    mask = np.isfinite(Y)
+    g1 = mask & (G == 1)
+    g0 = mask & (G == 0)
+    n1 = g1.sum(axis=0)
+    n0 = g0.sum(axis=0)
+    n = n1 + n0
+    Y0 = np.where(mask, Y, 0.)
+    m1 = (Y0 * g1).sum(axis=0) / n1
+    m0 = (Y0 * g0).sum(axis=0) / n0
+    rss = (((Y0 - m1) ** 2) * g1).sum(axis=0) + (((Y0 - m0) ** 2) * g0).sum(axis=0)
+    s2 = rss / (n - 2)
+    beta = m1 - m0
+    se = np.sqrt(s2 * (1. / n1 + 1. / n0))
+    t = beta / se
+    p = 2 * stats.t.sf(np.abs(t), n - 2)
+    return [result_row(test, 'lm', n[j], beta[j], se[j], t[j], t[j] ** 2, 1, p[j]) for j, test in enumerate(tests)]
+
+
+def lmm_deviance(theta, n, XtX, Xty, yty, ZtZ, ZtX, Zty, blocks):
+    # ML deviance of y = X b + Z u + e, u ~ N(0, sigma^2 Lambda^2), e ~ N(0, sigma^2 I), with b and sigma
+    # profiled out. Lambda is diagonal with the relative SD theta_k repeated over block k, so all work
+    # is done on q x q cross-products (q = number of random effects) rather than n x n.
+    lam = np.repeat(theta, blocks)
+    M = np.eye(len(lam)) + lam[:, None] * ZtZ * lam[None, :]
+    L = np.linalg.cholesky(M)
+    c_y = np.linalg.solve(L, lam * Zty)
+    C_X = np.linalg.solve(L, lam[:, None] * ZtX)
+    yViy = yty - np.dot(c_y, c_y)
+    if XtX.shape[0]:
+        XViX = XtX - np.dot(C_X.T, C_X)
+        XViy = Xty - np.dot(C_X.T, c_y)
+        b = np.linalg.solve(XViX, XViy)
+        rVir = yViy - np.dot(b, XViy)
+    else:
+        XViX = XtX
+        b = np.zeros(0)
+        rVir = yViy
+    sigma2 = rVir / n
+    logdet = 2 * np.sum(np.log(np.diag(L)))
+    dev = n * np.log(2 * np.pi * sigma2) + logdet + n
+    return dev, b, sigma2, XViX
+
+
+def fit_lmm(y, X, groups, starts=None):
+    # Crossed random-intercept LMM fit by maximum likelihood (REML=F), optimizing relative SDs theta.
+    # The profiled deviance can have boundary local optima, so keep the best of several starts.
+    Z = np.concatenate([np.eye(k.max() + 1)[k] for k in groups], axis=1)
+    blocks = [k.max() + 1 for k in groups]
+    args = (len(y), np.dot(X.T, X), np.dot(X.T, y), np.dot(y, y), np.dot(Z.T, Z), np.dot(Z.T, X), np.dot(Z.T, y), blocks)
+    k = len(groups)
+    if starts is None:
+        starts = []
+    starts = [np.ones(k), np.full(k, 0.1)] + [np.eye(k)[i] for i in range(k)] + list(starts)
+    res = None
+    for start in starts:
+        _res = optimize.minimize(
+            lambda theta: lmm_deviance(theta, *args)[0],
+            start,
+            method='L-BFGS-B',
+            bounds=[(0, None)] * k
+        )
+        if res is None or _res.fun < res.fun:
+            res = _res
+    theta = res.x
+    dev, b, sigma2, XViX = lmm_deviance(theta, *args)
+    if X.shape[1]:
+        se = np.sqrt(np.diag(sigma2 * np.linalg.inv(XViX)))
+    else:
+        se = np.zeros(0)
+    return {
+        'deviance': dev,
+        'beta': b,
+        'se': se,
+        'theta': theta,
+        'conv': bool(res.success),
+        'sing': bool(np.any(theta < 1e-4)),
+    }
+
+
+def fit_mixed_test(test):
+    y = test['y']
+    groups = [test['subject'], test['froi']]
+    if test['group'] is None:
+        X_full = np.ones((len(y), 1))
+        X_abl = np.zeros((len(y), 0))
+    else:
+        X_full = np.stack([np.ones(len(y)), test['group']], axis=1)
+        X_abl = np.ones((len(y), 1))
+    m_abl = fit_lmm(y, X_abl, groups)
+    m_full = fit_lmm(y, X_full, groups, starts=[m_abl['theta']])
+    chisq = max(m_abl['deviance'] - m_full['deviance'], 0.)
+    p = stats.chi2.sf(chisq, 1)
+    beta = m_full['beta'][-1]
+    se = m_full['se'][-1]
+    row = result_row(test, 'lmer', len(y), beta, se, beta / se, chisq, 1, p)
+    row['conv'] = 't' if (m_full['conv'] and m_abl['conv']) else 'f'
+    row['sing'] = 't' if (m_full['sing'] or m_abl['sing']) else 'f'
+    return row
+
+
+def result_row(test, model, n, beta, se, t, stat, df, p):
+    return {
+        'parcel_set': test['parcel_set'],
+        'experiment': test['experiment'],
+        'contrast': test['contrast'],
+        'fROI': test['fROI'],
+        'model': model,
+        'n': int(n),
+        'conv': 't',
+        'sing': 'f',
+        'beta': float(beta),
+        'se': float(se),
+        't': float(t),
+        'stat': float(stat),
+        'df': df,
+        'p': float(p)
+    }
+
+
+def run_tests(tests, jobs=1):
+    mixed = [test for test in tests if test['fROI'] == 'all']
+    intercept = [test for test in tests if test['fROI'] != 'all' and test['group'] is None]
+    group = [test for test in tests if test['fROI'] != 'all' and test['group'] is not None]
+
+    rows = []
+    if intercept:
+        rows += fit_intercept_tests(intercept)
+    if group:
+        rows += fit_group_tests(group)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            rows += list(pool.map(fit_mixed_test, mixed, chunksize=max(1, len(mixed) // (jobs * 4))))
+    else:
+        rows += [fit_mixed_test(test) for test in mixed]
+
+    out = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    return out.sort_values(['parcel_set', 'experiment', 'contrast', 'fROI']).reset_index(drop=True)
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Fit group-level models and likelihood ratio tests for every contrast (replaces regress_l2.R and test_l2.R).
+    ''')
+    argparser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes for the mixed models.')
+    argparser.add_argument('-o', '--output', default=os.path.join('lrt', 'results.csv'), help='Path to the results table.')
+    args = argparser.parse_args()
+
+    t0 = time.time()
+    try:
+        tests = collect_tests()
+    except FileNotFoundError:
+        sys.stderr.write('Contrast files not found. Run `python -m nlength.contrasts` before running this script.\n')
+        sys.stderr.flush()
+        exit()
+
+    out = run_tests(tests, jobs=args.jobs)
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    out.to_csv(args.output, index=False)
+    sys.stderr.write('Fit %d tests in %.2fs\n' % (len(out), time.time() - t0))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
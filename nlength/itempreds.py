@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from nlength.treebank import Treebank
+from nlength.measures import LINETREES, ITEMMEASURES, nelson_scores
+
+
+PRED_COLUMNS = ['opennodes', 'nmerged', 'itempos', 'chunkpos', 'chunkid']
+
+
+def split_row(line):
+    # Fields of a space-delimited row, keeping empty (missing) fields as pd.read_csv(sep=' ') does
+    return line.rstrip('\r\n').split(' ')
+
+
+def read_chunks(f, chunk_size):
+    # Non-blank lines of f in lists of chunk_size
+    chunk = []
+    for line in f:
+        if line.strip():
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def tree_scores(lines):
+    # Words, opennodes and nmerged of every word of a chunk of linetrees
+    treebank = Treebank.from_lines(lines)
+    scores = nelson_scores(treebank)
+    words = np.array(treebank.words, dtype=object)[treebank.word[treebank.leaves()]]
+    return words.tolist(), scores['opennodes'].tolist(), scores['nmerged'].tolist()
+
+
+def ordered_map(fn, chunks, jobs=1):
+    # fn over chunks by a pool of workers, yielding results in input order with at most 2 * jobs chunks in
+    # flight, so memory does not grow with the input
+    if jobs <= 1:
+        for x in chunks:
+            yield fn(x)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for x in chunks:
+            pending.append(pool.submit(fn, x))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def item_rows(trees, items, word_ix, jobs=1, chunk_size=1000):
+    # (fields, opennodes, nmerged) for every row of the item file. Rows are paired in order with the words of
+    # the trees; rows past the last tree get opennodes 1 and nmerged 0, as in plot_items.
+    n = 0
+    for words, opennodes, nmerged in ordered_map(tree_scores, read_chunks(trees, chunk_size), jobs=jobs):
+        for w, o, m in zip(words, opennodes, nmerged):
+            line = items.readline()
+            n += 1
+            if not line:
+                raise ValueError('Item file ends before word %d of the trees.' % n)
+            fields = split_row(line)
+            if fields[word_ix] != w:
+                raise ValueError('Word %d is "%s" in the trees but "%s" in the item file.' % (n, w, fields[word_ix]))
+            yield fields, o, m
+    for line in items:
+        if line.strip():
+            yield split_row(line), 1, 0
+
+
+def write_itempreds(linetrees, items, output, jobs=1, chunk_size=1000):
+    # Stream the trees and the (space-delimited) item file into an itemmeasures-style table with the item
+    # columns plus PRED_COLUMNS. Segmentation follows plot_items: itempos counts words within docid, chunkpos
+    # restarts every conlen words and chunkid increments whenever chunkpos does not continue the previous row.
+    # The rows of a docid are contiguous in item files, so itempos restarts whenever docid changes and only
+    # the current docid is tracked. Rows are written in order as they come, so the output does not depend on
+    # jobs.
+    n = 0
+    with open(linetrees, 'r') as t, open(items, 'r') as m, open(output, 'w') as out:
+        header = split_row(m.readline())
+        word_ix = header.index('word')
+        docid_ix = header.index('docid')
+        conlen_ix = header.index('conlen')
+        out.write(' '.join(header + PRED_COLUMNS) + '\n')
+
+        docid = None
+        pos = 0
+        chunkpos = None
+        chunkid = 0
+        buf = []
+        for fields, opennodes, nmerged in item_rows(t, m, word_ix, jobs=jobs, chunk_size=chunk_size):
+            if fields[docid_ix] != docid:
+                docid = fields[docid_ix]
+                pos = 0
+            pos += 1
+            try:
+                conlen = int(fields[conlen_ix])
+            except ValueError:
+                conlen = 0
+            if conlen <= 0:
+                raise ValueError('Row %d of %s (docid %s): conlen must be a positive integer, got "%s".' % (
+                    n + 1, items, docid, fields[conlen_ix]))
+            prev = chunkpos
+            chunkpos = (pos - 1) % conlen + 1
+            if prev is None or chunkpos - prev != 1:
+                chunkid += 1
+            buf.append(' '.join(fields + [str(opennodes), str(nmerged), str(pos), str(chunkpos), str(chunkid)]))
+            n += 1
+            if len(buf) >= chunk_size:
+                out.write('\n'.join(buf) + '\n')
+                buf = []
+        if buf:
+            out.write('\n'.join(buf) + '\n')
+
+    return n
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Stream a linetrees file and an item file (space-delimited, one row per word with at least word, docid and
+    conlen columns) into an itemmeasures-compatible table with tree-derived predictors (opennodes, nmerged)
+    and item segmentation (itempos, chunkpos, chunkid).
+    ''')
+    argparser.add_argument('-t', '--linetrees', default=LINETREES, help='Path to the trees, one per line.')
+    argparser.add_argument('-i', '--items', default=ITEMMEASURES, help='Path to the item file.')
+    argparser.add_argument('-o', '--output', default='ling_preds/conlen.itempreds', help='Path to the output table.')
+    argparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of worker processes (default: all cores).')
+    argparser.add_argument('--chunk_size', type=int, default=1000, help='Sentences per worker task.')
+    args = argparser.parse_args()
+
+    t0 = time.time()
+    n = write_itempreds(args.linetrees, args.items, args.output, jobs=args.jobs, chunk_size=args.chunk_size)
+    sys.stderr.write('Wrote %d rows to %s in %.2fs\n' % (n, args.output, time.time() - t0))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
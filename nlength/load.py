@@ -0,0 +1,73 @@
+import os
+import pandas as pd
+
+from nlength.config import fROIs, networks, parcel_set_map
+from nlength.cache import read_effect_sizes
+
+
+EFFECT_FILE = 'spm_ss_mROI_data.details.EffectSize.csv'
+
+
+def nlength_sources(base_path, parcel_set_path, experiment):
+    if experiment == 1:
+        return [
+            os.path.join(base_path, 'main', 'nlength_con_n16', parcel_set_path, 'mROI_NlengthEFFECT_langLOC', EFFECT_FILE)
+        ]
+    return [
+        os.path.join(base_path, 'main', 'old_subjects_n25', parcel_set_path, 'mROI_NlengthEFFECT_langLOC', EFFECT_FILE),
+        os.path.join(base_path, 'main', 'old_subjects_n25', parcel_set_path, 'mROI_NlengthEFFECT_langrun1LOC', EFFECT_FILE),
+        os.path.join(base_path, 'main', 'new_subjects_n15', parcel_set_path, 'mROI_NlengthEFFECT_langLOC', EFFECT_FILE),
+    ]
+
+
+def sixwords_sources(base_path, parcel_set_path):
+    return [
+        os.path.join(base_path, 'main', '6words_n20', parcel_set_path, 'mROI_6wordsEFFECT_langLOC', EFFECT_FILE),
+        os.path.join(base_path, 'main', '6words_n20', parcel_set_path, 'mROI_6wordsEFFECT_aliceLOC', EFFECT_FILE),
+    ]
+
+
+def unit_sources(base_path, parcel_set, experiment):
+    parcel_set_path = parcel_set_map[parcel_set]
+    if experiment == '6words':
+        return sixwords_sources(base_path, parcel_set_path)
+    return nlength_sources(base_path, parcel_set_path, experiment)
+
+
+def network_rois(parcel_set):
+    # 1-based spm_ss ROI indices of the parcel set's network
+    return [fROIs[parcel_set].index(x) + 1 for x in networks[parcel_set]]
+
+
+class LoadPlan:
+    # Collects the EffectSize files needed by a set of analyses, reads each distinct file once,
+    # and hands out the ROI rows each analysis needs.
+
+    def __init__(self):
+        self.paths = []
+        self.frames = {}
+
+    def add(self, paths):
+        for path in paths:
+            if path not in self.paths:
+                self.paths.append(path)
+        return self
+
+    def load(self):
+        for path in self.paths:
+            if path not in self.frames:
+                self.frames[path] = read_effect_sizes(path)
+        return self
+
+    def get(self, paths, rois=None):
+        if not all(path in self.frames for path in paths):
+            self.add(paths).load()
+        df = []
+        for path in paths:
+            _df = self.frames[path]
+            if rois is not None:
+                _df = _df[_df.ROI.isin(rois)]
+            df.append(_df)
+        if len(df) == 1:
+            return df[0]
+        return pd.concat(df, axis=0)
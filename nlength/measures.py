@@ -0,0 +1,269 @@
+import os
+import re
+import sys
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+from nlength.treebank import Treebank, TREEBANK_VERSION, ancestor_sums, chain_tops
+from nlength.cache import get_key, cache_path, read_arrays, write_arrays, touch, evict
+
+
+LINETREES = 'ling_preds/conlenc.gold.linetrees'
+ITEMMEASURES = 'ling_preds/conlen2fmri.wsj02to21-gcg15-nol-prtrm-3sm-synproc-+c_+u_+b5000_parsed.dlt.lc.unigram.5-kenlm.all-itemmeasures'
+NELSON_SCORES = ['sentence', 'pending', 'closed', 'opennodes', 'nmerged']
+LC_MEASURES = ['embddepthAny', 'startembdAny', 'endembdAny', 'embdlen', 'embddepthMin', 'noF', 'noFlen', 'yesJ']
+# gap (-g), head (-h), relative (-r) and passive (-v) features, and non-local (-lN) dependents
+NON_LOCAL = re.compile('-[ghrv]|-lN$')
+AWAITS = re.compile('-h|-lN$')
+
+
+def nelson_scores(treebank):
+    # Batch version of plot_items.get_nelson_scores (on unary-collapsed trees) plus nmerged, for every word
+    # of every tree at once. Reading the recursion as path sums: a word's pending count gains 1 for each
+    # ancestor-or-self that is the right child of a binary node whose left child spans one word, and its
+    # closed count gains 1 for each one whose left child spans more. Collapsing unary branches never removes
+    # those nodes or changes the spans, so the scores are computed on the trees as read.
+    n_children = treebank.n_children()
+    if (n_children > 2).any():
+        i = np.searchsorted(treebank.offsets, np.flatnonzero(n_children > 2)[0], side='right') - 1
+        raise ValueError('Non-binary tree. %s' % treebank.tree(i))
+
+    is_word = n_children == 0
+    n_words = np.concatenate([[0], np.cumsum(is_word)])
+    left = treebank.first_child[n_children == 2]
+    right = treebank.next_sibling[left]
+    span = n_words[right] - n_words[left]
+    # pending in the low 32 bits, closed in the high 32 bits
+    weights = np.zeros(treebank.n_nodes, dtype=np.int64)
+    weights[right] = np.where(span == 1, 1, 1 << 32)
+    sums = ancestor_sums(treebank.parent, weights)
+
+    words = np.flatnonzero(is_word)
+    sentence = np.searchsorted(treebank.offsets, words, side='right') - 1
+    pending = (sums[words] & 0xFFFFFFFF) + 1
+    closed = sums[words] >> 32
+
+    # nmerged: drop in pending from each word to the next, with 0 after the last word of a sentence
+    next_pending = np.zeros_like(pending)
+    next_pending[:-1] = pending[1:]
+    next_pending[np.append(sentence[1:] != sentence[:-1], True)] = 0
+
+    return {
+        'sentence': sentence,
+        'pending': pending,
+        'closed': closed,
+        'opennodes': pending + closed,
+        'nmerged': np.maximum(pending - next_pending + 1, 0)
+    }
+
+
+def read_treebank(path):
+    # Parsed, unary-collapsed treebank and its nelson_scores, through a binary cache keyed by a hash of the
+    # file contents and the treebank version, so that it is rebuilt whenever either changes. Cache hits are
+    # memory-mapped.
+    with open(path, 'rb') as f:
+        data = f.read()
+    cached = cache_path(get_key(TREEBANK_VERSION, hashlib.sha1(data).hexdigest()), kind='treebank')
+    if os.path.exists(cached):
+        try:
+            arrays, meta = read_arrays(cached)
+            treebank = Treebank.from_arrays(arrays, meta)
+            touch(cached)
+            return treebank, {x: arrays[x] for x in NELSON_SCORES}
+        except (ValueError, KeyError, OSError):
+            pass
+
+    treebank = Treebank.from_lines(data.decode('utf-8').splitlines(True)).collapse_unary()
+    scores = nelson_scores(treebank)
+    arrays, meta = treebank.arrays()
+    arrays.update(scores)
+    meta['source'] = os.path.abspath(path)
+    try:
+        write_arrays(cached, arrays, meta)
+        evict()
+    except OSError as e:
+        sys.stderr.write('Could not write cache entry for %s (%s).\n' % (path, e))
+
+    return treebank, scores
+
+
+def sentence_starts(sentence):
+    return np.append(True, sentence[1:] != sentence[:-1])
+
+
+def embedding_edges(depth, sentence):
+    # Words where the depth rises (start) or falls (end), from 0 before each sentence
+    prev = np.zeros_like(depth)
+    prev[1:] = depth[:-1]
+    prev[sentence_starts(sentence)] = 0
+    return (depth > prev).astype(int), (depth < prev).astype(int), prev
+
+
+def embedding_lengths(depth, sentence):
+    # Length in words of the embedded region closed at each word (0 elsewhere): a fall from level k + 1 is
+    # matched to the latest rise to level k + 1 before it. Depths move by at most one level per word.
+    start, end, prev = embedding_edges(depth, sentence)
+    pos = np.arange(len(depth))
+    rises = np.flatnonzero(start)
+    falls = np.flatnonzero(end)
+    keys = depth[rises].astype(np.int64) * len(depth) + rises
+    order = np.argsort(keys)
+    i = np.searchsorted(keys[order], prev[falls].astype(np.int64) * len(depth) + falls) - 1
+    out = np.zeros(len(depth), dtype=int)
+    out[falls] = pos[falls] - rises[order][i] + 1
+    return out
+
+
+def lc_measures(treebank):
+    # Left-corner parser measures (cf. the .lc. itemmeasures columns) for every word of every tree at once,
+    # read off the geometry of the unary-collapsed trees. A word's node (the top of its unary chain) forks a
+    # new derivation fragment unless it is a right child, which it completes (noF). It joins if the node
+    # whose role it settles is itself a right child: its parent after a fork, or the top of the chain of
+    # right children it completes otherwise. The number of fragments is the running sum of fork - join.
+    # embddepthMin is the fragment count (at least 1) plus any fragment opened by a non-local category on the
+    # left spine, and embddepthAny adds to it the fragment count again plus each relative clause (-r) the word
+    # is inside of or awaits as a right child and each embedded -h fragment it is inside of. Start, end and
+    # length of embedded regions follow from the depths.
+    tb = treebank.collapse_unary()
+    parent = tb.parent.astype(np.int64)
+    n = tb.n_nodes
+    has_parent = parent >= 0
+    is_right = np.zeros(n, dtype=bool)
+    is_right[has_parent] = tb.first_child[parent[has_parent]] != np.flatnonzero(has_parent)
+
+    words = tb.leaves()
+    sentence = np.searchsorted(tb.offsets, words, side='right') - 1
+    p = parent[words]
+    u = np.where((p >= 0) & (tb.n_children()[np.maximum(p, 0)] == 1), p, words)
+
+    fork = ~is_right[u]
+    up = np.where(fork, parent[u], parent[chain_tops(parent, is_right)[u]])
+    join = (up < 0) | is_right[np.maximum(up, 0)]
+
+    step = fork.astype(int) - join.astype(int)
+    depth = np.cumsum(step)
+    starts = sentence_starts(sentence)
+    depth -= (depth - step)[starts][np.cumsum(starts) - 1]
+
+    # noFlen: age in words of the fragment a word completes. A fork without a join opens a fragment at that
+    # word; a completion without a join replaces the fragment with one opened at the next word.
+    pos = np.arange(len(words), dtype=np.int64)
+    opened = np.flatnonzero(fork & ~join)
+    reopened = np.flatnonzero(~fork & ~join)
+    keys = np.concatenate([depth[opened] * len(pos) + opened, depth[reopened] * len(pos) + reopened + 1])
+    keys.sort()
+    completes = np.flatnonzero(~fork)
+    i = np.searchsorted(keys, (depth[completes] + join[completes]) * len(pos) + completes, side='right') - 1
+    noFlen = np.zeros(len(pos), dtype=int)
+    noFlen[completes] = completes - keys[i] % len(pos) + 1
+
+    # relative clauses (-r) and -h fragments pending after each word: right children with -r and left children
+    # with -h off the left spine among the ancestors-or-self of the node awaiting the next word, the top of the
+    # chain of left children above the next word's node
+    label = np.maximum(tb.label, 0)
+    rel = np.array(['-r' in x for x in tb.labels])[label]
+    head = np.array(['-h' in x for x in tb.labels])[label]
+    off_spine = parent[chain_tops(parent, ~is_right)] >= 0
+    weights = (tb.label >= 0) & np.where(is_right, rel, head & off_spine)
+    pending = ancestor_sums(tb.parent, weights.astype(np.int64))
+    last = np.append(starts[1:], True)
+    awaited = chain_tops(parent, ~is_right)[np.append(u[1:], u[-1:])]
+    pending = np.where(last, 0, pending[awaited])
+
+    # non-local fragments: a sentence whose left spine (in the uncollapsed trees) carries a non-local category
+    # (-g, -h, -r, -v or an -lN dependent) opens one more fragment at its first word. The fragment closes at
+    # the last word of the highest spine node that awaits its non-local argument (-h, or -lN outside relative
+    # clauses), and otherwise stays open to the end of the sentence.
+    parent0 = treebank.parent.astype(np.int64)
+    has_parent0 = parent0 >= 0
+    is_right0 = np.zeros(treebank.n_nodes, dtype=bool)
+    is_right0[has_parent0] = treebank.first_child[parent0[has_parent0]] != np.flatnonzero(has_parent0)
+    spine = (parent0[chain_tops(parent0, ~is_right0)] < 0) & (treebank.label >= 0)
+    label0 = np.maximum(treebank.label, 0)
+    node_sentence = np.searchsorted(treebank.offsets, np.arange(treebank.n_nodes), side='right') - 1
+    non_local = np.array([bool(NON_LOCAL.search(x)) for x in treebank.labels])[label0]
+    opens = np.bincount(node_sentence[spine & non_local], minlength=len(treebank)) > 0
+    awaits = np.array([bool(AWAITS.search(x)) and '-r' not in x for x in treebank.labels])[label0]
+    closing = np.flatnonzero(spine & awaits)
+    # in preorder, the first closing node of each sentence is the highest
+    closing_sentence, highest = np.unique(node_sentence[closing], return_index=True)
+    end = np.full(len(treebank), np.iinfo(np.int64).max)
+    end[closing_sentence] = treebank.r[closing[highest]]
+    extra = opens[sentence] & (tb.l[words] < end[sentence])
+
+    embddepthMin = np.maximum(depth + extra, 1)
+    embddepthAny = embddepthMin + depth + pending
+    startembdAny, endembdAny, _ = embedding_edges(embddepthAny, sentence)
+
+    return {
+        'sentence': sentence,
+        'embddepthAny': embddepthAny,
+        'startembdAny': startembdAny,
+        'endembdAny': endembdAny,
+        'embdlen': embedding_lengths(embddepthMin, sentence),
+        'embddepthMin': embddepthMin,
+        'noF': (~fork).astype(int),
+        'noFlen': noFlen,
+        'yesJ': join.astype(int)
+    }
+
+
+def item_table(treebank):
+    # Word-level predictors of every tree, one row per word as in the itemmeasures files
+    lc = lc_measures(treebank)
+    nelson = nelson_scores(treebank)
+    sentence = lc['sentence']
+    starts = sentence_starts(sentence)
+    sentpos = np.arange(len(sentence)) - np.flatnonzero(starts)[np.cumsum(starts) - 1] + 1
+    out = pd.DataFrame({
+        'word': np.array(treebank.words, dtype=object)[treebank.word[treebank.leaves()]],
+        'sentid': sentence,
+        'sentpos': sentpos
+    })
+    for x in LC_MEASURES:
+        out[x] = lc[x]
+    out['opennodes'] = nelson['opennodes']
+    out['nmerged'] = nelson['nmerged']
+    return out
+
+
+def agreement(out, itemmeasures, columns=LC_MEASURES):
+    # Share of words with matching values, over the leading itemmeasures rows whose words match the trees
+    n = min(len(out), len(itemmeasures))
+    match = out.word.values[:n] == itemmeasures.word.values[:n]
+    rates = {}
+    for x in columns:
+        if x in itemmeasures:
+            rates[x] = (out[x].values[:n][match] == itemmeasures[x].values[:n][match]).mean()
+    return rates, match.sum()
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Compute word-level syntactic predictors (left-corner measures, open nodes and merges) from linetrees
+    and save them as an itemmeasures-style (space-delimited) table.
+    ''')
+    argparser.add_argument('-t', '--linetrees', default=LINETREES, help='Path to the trees, one per line.')
+    argparser.add_argument('-o', '--output', default='ling_preds/conlenc.gold.lcmeasures', help='Path to the output table.')
+    argparser.add_argument('-c', '--compare', nargs='?', const=ITEMMEASURES, default=None, help='Report agreement with an itemmeasures file (default: the released one).')
+    args = argparser.parse_args()
+
+    t0 = time.time()
+    treebank = Treebank.read(args.linetrees)
+    out = item_table(treebank)
+    out.to_csv(args.output, sep=' ', index=False)
+    sys.stderr.write('Computed predictors for %d words (%d trees) in %.2fs\n' % (len(out), len(treebank), time.time() - t0))
+
+    if args.compare:
+        rates, n = agreement(out, pd.read_csv(args.compare, sep=' '))
+        sys.stderr.write('Agreement with %s (%d words):\n' % (args.compare, n))
+        for x in rates:
+            sys.stderr.write('  %s: %.2f%%\n' % (x, rates[x] * 100))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+import os
+import re
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from nlength.cache import source_key, cache_path, read_arrays, write_arrays, touch, evict
+from nlength.itempreds import split_row
+
+
+NGRAM_VERSION = 1
+BOS = '<s>'
+EOS = '</s>'
+UNK = '<unk>'
+# log10 probability of <unk> when the model lacks it (as in KenLM)
+UNK_LOGPROB = -100.
+SECTION = re.compile(r'\\([0-9]+)-grams:')
+COUNT = re.compile(r'ngram ([0-9]+)\s*=\s*([0-9]+)$')
+M1 = np.uint64(0xbf58476d1ce4e5b9)
+M2 = np.uint64(0x94d049bb133111eb)
+
+
+def mix(h):
+    # splitmix64 finalizer, elementwise on uint64 arrays
+    with np.errstate(over='ignore'):
+        h = (h ^ (h >> np.uint64(30))) * M1
+        h = (h ^ (h >> np.uint64(27))) * M2
+    return h ^ (h >> np.uint64(31))
+
+
+def extend_hash(h, ids):
+    # Hash of an n-gram from the hash of its first n - 1 words and the id of its last word
+    with np.errstate(over='ignore'):
+        return mix(h + ids.astype(np.uint64) + np.uint64(1))
+
+
+def ngram_hashes(ids):
+    # Hashes of the rows of an (n_ngrams, n) array of word ids
+    h = np.zeros(len(ids), dtype=np.uint64)
+    for j in range(ids.shape[1]):
+        h = extend_hash(h, ids[:, j])
+    return h
+
+
+def read_arpa(path):
+    # Vocabulary and, for each order, the word ids, log10 probabilities and backoff weights of an ARPA file,
+    # read into arrays preallocated from the n-gram counts of its \data\ header
+    vocab = {}
+    counts = []
+    orders = []
+    with open(path, 'r', encoding='utf-8') as f:
+        order = 0
+        i = 0
+        ids = probs = backoffs = None
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('\\'):
+                if order and i != len(probs):
+                    raise ValueError('%d-grams section of %s has %d entries, expected %d.' % (order, path, i, len(probs)))
+                m = SECTION.match(line)
+                if m:
+                    order = int(m.group(1))
+                    if order != len(orders) + 1 or order > len(counts):
+                        raise ValueError('Unexpected %d-grams section in %s.' % (order, path))
+                    i = 0
+                    ids = np.empty((counts[order - 1], order), dtype=np.int64)
+                    probs = np.empty(counts[order - 1], dtype=np.float32)
+                    backoffs = np.zeros(counts[order - 1], dtype=np.float32)
+                    orders.append((ids, probs, backoffs))
+                else:
+                    order = 0
+                continue
+            if not order:
+                m = COUNT.match(line)
+                if m:
+                    if int(m.group(1)) != len(counts) + 1:
+                        raise ValueError('Unexpected n-gram count in %s: %s' % (path, line))
+                    counts.append(int(m.group(2)))
+                continue
+            fields = line.split()
+            if len(fields) not in (order + 1, order + 2):
+                raise ValueError('Malformed %d-gram line in %s: %s' % (order, path, line))
+            if i == len(probs):
+                raise ValueError('%d-grams section of %s has more than %d entries.' % (order, path, len(probs)))
+            if order == 1:
+                vocab.setdefault(fields[1], len(vocab))
+            ids[i] = [vocab[x] for x in fields[1:order + 1]]
+            probs[i] = float(fields[0])
+            if len(fields) == order + 2:
+                backoffs[i] = float(fields[order + 1])
+            i += 1
+    if order and i != len(probs):
+        raise ValueError('%d-grams section of %s has %d entries, expected %d.' % (order, path, i, len(probs)))
+    if not orders:
+        raise ValueError('No n-grams found in %s.' % path)
+
+    return list(vocab), orders
+
+
+def compile_arpa(path, output):
+    # Convert an ARPA file into sorted n-gram hashes with their probabilities and backoffs, one table per
+    # order, in the memory-mappable cache format
+    vocab, orders = read_arpa(path)
+    arrays = {}
+    if UNK not in vocab:
+        vocab.append(UNK)
+        orders[0] = (
+            np.append(orders[0][0], [[len(vocab) - 1]], axis=0),
+            np.append(orders[0][1], np.float32(UNK_LOGPROB)),
+            np.append(orders[0][2], np.float32(0.))
+        )
+    for n, (ids, probs, backoffs) in enumerate(orders, 1):
+        h = ngram_hashes(ids)
+        order = np.argsort(h, kind='stable')
+        h = h[order]
+        if (h[1:] == h[:-1]).any():
+            raise ValueError('Hash collision among the %d-grams of %s.' % (n, path))
+        arrays['hash%d' % n] = h
+        arrays['prob%d' % n] = probs[order]
+        if n < len(orders):
+            arrays['backoff%d' % n] = backoffs[order]
+    write_arrays(output, arrays, {'version': NGRAM_VERSION, 'order': len(orders), 'vocab': vocab, 'source': os.path.abspath(path)})
+
+
+def compiled_path(path):
+    # Where the compiled form of a model lives: the path itself for .nlc files, the binary cache for ARPA files
+    if path.endswith('.nlc'):
+        return path
+    return cache_path(source_key(path, version=NGRAM_VERSION), kind='ngram')
+
+
+class NgramModel:
+    # A backoff n-gram language model over sorted hash tables (see compile_arpa), typically memory-mapped so
+    # that worker processes share one copy
+
+    def __init__(self, arrays, meta):
+        if meta.get('version') != NGRAM_VERSION:
+            raise ValueError('N-gram model version %s, expected %s.' % (meta.get('version'), NGRAM_VERSION))
+        self.order = meta['order']
+        self.vocab = {x: i for i, x in enumerate(meta['vocab'])}
+        self.unk = self.vocab[UNK]
+        self.hashes = [arrays['hash%d' % n] for n in range(1, self.order + 1)]
+        self.probs = [arrays['prob%d' % n] for n in range(1, self.order + 1)]
+        self.backoffs = [arrays['backoff%d' % n] for n in range(1, self.order)]
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # Load a compiled model, or an ARPA file through the binary cache
+        compiled = compiled_path(path)
+        written = False
+        if compiled != path:
+            if os.path.exists(compiled):
+                touch(compiled)
+            else:
+                compile_arpa(path, compiled)
+                written = True
+        model = cls(*read_arrays(compiled, mmap=mmap))
+        if written:
+            # the new entry stays even if it alone exceeds the cache size, since workers map it by path
+            evict(keep=[compiled])
+        return model
+
+    def lookup(self, n, h):
+        # Index into the n-gram table of each hash, and whether it is present
+        table = self.hashes[n - 1]
+        i = np.minimum(np.searchsorted(table, h), len(table) - 1)
+        return i, table[i] == h
+
+    def ids(self, words):
+        return np.array([self.vocab.get(x, self.unk) for x in words], dtype=np.int64)
+
+    def score(self, sentences):
+        # log10 probabilities of every word of the sentences (lists of words) given its in-sentence history,
+        # with backoff, all positions at once: a word's probability comes from the longest n-gram ending in
+        # it that is in the model, plus the backoff weights of every longer history. Also returns the
+        # unigram log10 probabilities.
+        lengths = np.array([len(x) for x in sentences], dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(lengths + 1)])
+        tokens = []
+        for x in sentences:
+            tokens.append(BOS)
+            tokens.extend(x)
+        ids = self.ids(tokens)
+        # position within the sentence, <s> being 0
+        pos = np.arange(len(ids)) - np.repeat(starts[:-1], lengths + 1)
+
+        logprob = np.zeros(len(ids), dtype=np.float64)
+        unigram = None
+        best = np.zeros(len(ids), dtype=bool)
+        backoff = np.zeros(len(ids), dtype=np.float64)
+        # hashes[n - 1][i]: hash of the n-gram ending at i (meaningful where pos >= n - 1)
+        hashes = []
+        prev = np.zeros(len(ids), dtype=np.uint64)
+        for n in range(1, self.order + 1):
+            h = extend_hash(prev, ids)
+            hashes.append(h)
+            prev = np.zeros_like(h)
+            prev[1:] = h[:-1]
+
+        # from the highest order down: the first n-gram found sets the probability, and every longer
+        # history that was not found contributes its backoff weight
+        for n in range(self.order, 0, -1):
+            valid = pos >= n - 1
+            i, found = self.lookup(n, hashes[n - 1])
+            found &= valid
+            if n == 1:
+                unigram = self.probs[0][i].astype(np.float64)
+            take = found & ~best
+            logprob[take] = self.probs[n - 1][i[take]] + backoff[take]
+            best |= found
+            if n > 1:
+                # backoff weight of the (n - 1)-word history, for positions still backing off
+                j, ctx = self.lookup(n - 1, np.concatenate([[np.uint64(0)], hashes[n - 2][:-1]]))
+                ctx &= pos >= n - 1
+                add = ctx & ~best
+                backoff[add] += self.backoffs[n - 2][j[add]]
+
+        words = pos > 0
+        return logprob[words], unigram[words]
+
+
+MODEL = None
+
+
+def init_worker(path):
+    global MODEL
+    MODEL = NgramModel.load(path)
+
+
+def score_chunk(sentences):
+    return MODEL.score(sentences)
+
+
+def surprisal(model_path, sentences, jobs=1, chunk_size=10000):
+    # Per-word n-gram and unigram surprisal (-log10 p) of the sentences. Workers map the compiled model
+    # rather than receiving a copy.
+    model = NgramModel.load(model_path)
+    compiled = compiled_path(model_path)
+    chunks = [sentences[i:i + chunk_size] for i in range(0, len(sentences), chunk_size)]
+    if jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(compiled,)) as pool:
+            out = list(pool.map(score_chunk, chunks))
+    else:
+        out = [model.score(x) for x in chunks]
+    if not out:
+        return np.zeros(0), np.zeros(0), model.order
+    logprob = np.concatenate([x[0] for x in out])
+    unigram = np.concatenate([x[1] for x in out])
+    return -logprob, -unigram, model.order
+
+
+def read_sentences(path, kind):
+    # Sentences (lists of words) and the rows they come from: one per tree for linetrees, one per run of
+    # rows with the same sentid for item files
+    if kind == 'linetrees':
+        from nlength.treebank import Treebank
+        treebank = Treebank.read(path)
+        sentences = [treebank.sentence(i) for i in range(len(treebank))]
+        rows = pd.DataFrame({
+            'word': [x for s in sentences for x in s],
+            'sentid': np.repeat(np.arange(len(sentences)), [len(x) for x in sentences]),
+            'sentpos': np.concatenate([np.arange(1, len(x) + 1) for x in sentences] + [np.zeros(0, dtype=int)])
+        })
+        return sentences, rows
+    with open(path, 'r') as f:
+        header = split_row(f.readline())
+        rows = [split_row(line) for line in f if line.strip()]
+    rows = pd.DataFrame(rows, columns=header)
+    words = rows['word'].tolist()
+    sentid = rows['sentid'].values
+    bounds = np.flatnonzero(np.append(True, sentid[1:] != sentid[:-1])).tolist() + [len(rows)]
+    return [words[a:b] for a, b in zip(bounds[:-1], bounds[1:])], rows
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Score the words of a linetrees or item file with an ARPA n-gram language model and write n-gram
+    (fwprob<N>surp) and unigram (unigramsurp) surprisal (-log10 p) for every word.
+    ''')
+    argparser.add_argument('model', help='Path to an ARPA model (compiled into the binary cache on first use) or a compiled .nlc model.')
+    argparser.add_argument('-t', '--linetrees', default=None, help='Path to trees, one per line.')
+    argparser.add_argument('-i', '--items', default=None, help='Path to a space-delimited item file with word and sentid columns.')
+    argparser.add_argument('-o', '--output', default='ling_preds/conlen.ngram', help='Path to the output table.')
+    argparser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes.')
+    argparser.add_argument('--chunk_size', type=int, default=10000, help='Sentences per worker task.')
+    args = argparser.parse_args()
+
+    if (args.linetrees is None) == (args.items is None):
+        argparser.error('Exactly one of --linetrees and --items is required.')
+
+    t0 = time.time()
+    if args.items is None:
+        sentences, rows = read_sentences(args.linetrees, 'linetrees')
+    else:
+        sentences, rows = read_sentences(args.items, 'items')
+    surp, unigram, order = surprisal(args.model, sentences, jobs=args.jobs, chunk_size=args.chunk_size)
+    rows['unigramsurp'] = unigram
+    rows['fwprob%dsurp' % order] = surp
+    rows.to_csv(args.output, sep=' ', index=False)
+    sys.stderr.write('Scored %d words (%d sentences) in %.2fs\n' % (len(rows), len(sentences), time.time() - t0))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
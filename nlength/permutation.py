@@ -0,0 +1,198 @@
+import sys
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from nlength.group import PARCEL_SETS, EXPERIMENTS, BETWEENGROUPS_CONTRASTS, read_all_contrasts, betweengroups_data
+
+
+KEY_COLUMNS = ['Subject', 'fROI']
+RESULT_COLUMNS = ['parcel_set', 'experiment', 'contrast', 'fROI', 'test', 'n', 't', 'p', 'p_fwe']
+TOL = 1e-10
+
+# Blocks of tests shared by the worker processes (set by init_worker)
+BLOCKS = None
+
+
+def make_block(parcel_set, experiment, contrasts, df, test='sign', rows=('Subject',)):
+    # Subject x (contrast, fROI) data matrix with NaNs zeroed out and a validity mask.
+    # Columns are contrast-major, so each contrast's fROIs (one max-T family) are contiguous.
+    fROIs = list(pd.unique(df.fROI))
+    wide = df.pivot_table(index=list(rows), columns='fROI', values=contrasts, aggfunc='first', dropna=False)
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([contrasts, fROIs]))
+    Y = wide.values.astype(float)
+    M = np.isfinite(Y)
+    Y = np.where(M, Y, 0.)
+    block = {
+        'parcel_set': parcel_set,
+        'experiment': experiment,
+        'test': test,
+        'contrast': np.repeat(contrasts, len(fROIs)),
+        'fROI': np.tile(fROIs, len(contrasts)),
+        'starts': np.arange(0, len(contrasts) * len(fROIs), len(fROIs)),
+        'Y': Y,
+        'M': M.astype(float),
+    }
+    if test == 'label':
+        block['labels'] = wide.index.get_level_values('experiment').values.astype(float)
+        block['rhs'] = np.concatenate([block['M'], Y, Y ** 2], axis=1)
+    else:
+        block['n'] = M.sum(axis=0)
+        block['ss'] = (Y ** 2).sum(axis=0)
+    return block
+
+
+def collect_blocks(contrast_path='contrasts'):
+    data = read_all_contrasts(contrast_path=contrast_path)
+    blocks = []
+    for parcel_set in PARCEL_SETS:
+        for experiment in EXPERIMENTS:
+            df = data[(parcel_set, experiment)]
+            contrasts = [x for x in df.columns if x not in KEY_COLUMNS]
+            blocks.append(make_block(parcel_set, experiment, contrasts, df))
+    for parcel_set in PARCEL_SETS:
+        for contrast in BETWEENGROUPS_CONTRASTS:
+            df = betweengroups_data(data, parcel_set, contrast).rename(columns={'Effect': contrast})
+            blocks.append(make_block(parcel_set, 'betweengroups', [contrast], df, test='label', rows=('experiment', 'Subject')))
+    return blocks
+
+
+def sign_t(S, block):
+    # One-sample t for each row of signs S [n_perm, n_subj] and every column at once.
+    # The sum of squares does not change under sign flips, so a single product gives all the means.
+    # Columns with fewer than 2 subjects or no variance give non-finite t (see run_chunk)
+    n = block['n']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.dot(S, block['Y']) / n
+        var = (block['ss'] - n * mean ** 2) / (n - 1)
+        return mean / np.sqrt(var / n)
+
+
+def label_t(G, block):
+    # Pooled-variance two-sample t for each row of 0/1 group labels G [n_perm, n_rows] and every column.
+    # Counts, sums and sums of squares of group 1 come from one product with [M, Y, Y^2].
+    k = block['Y'].shape[1]
+    totals = block['rhs'].sum(axis=0)
+    out = np.dot(G, block['rhs'])
+    n1, s1, q1 = out[:, :k], out[:, k:2 * k], out[:, 2 * k:]
+    n, s, q = totals[:k], totals[k:2 * k], totals[2 * k:]
+    n0 = n - n1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m1 = s1 / n1
+        m0 = (s - s1) / n0
+        rss = q1 - n1 * m1 ** 2 + (q - q1) - n0 * m0 ** 2
+        return (m1 - m0) / np.sqrt(rss / (n - 2) * (1. / n1 + 1. / n0))
+
+
+def observed_t(block):
+    if block['test'] == 'label':
+        return label_t(block['labels'][None, :], block)[0]
+    return sign_t(np.ones((1, block['Y'].shape[0])), block)[0]
+
+
+def init_worker(blocks):
+    global BLOCKS
+    BLOCKS = blocks
+
+
+def run_chunk(task):
+    # Exceedance counts (uncorrected and max-T) for one chunk of random sign flips or relabelings
+    i, seed, size = task
+    block = BLOCKS[i]
+    rng = np.random.default_rng(seed)
+    n_rows = block['Y'].shape[0]
+    if block['test'] == 'label':
+        G = rng.permuted(np.tile(block['labels'], (size, 1)), axis=1)
+        T = np.abs(label_t(G, block))
+    else:
+        S = 1. - 2. * rng.integers(0, 2, size=(size, n_rows), dtype=np.int8)
+        T = np.abs(sign_t(S, block))
+    # Columns without a finite observed t (n < 2 or zero variance) are not tested and stay out of the family max
+    valid = np.isfinite(block['t_obs'])
+    T = np.where(valid, np.nan_to_num(T, nan=0.), 0.)
+    t_obs = np.where(valid, np.abs(block['t_obs']) - TOL, np.inf)
+    family = np.repeat(np.arange(len(block['starts'])), np.diff(np.append(block['starts'], T.shape[1])))
+    max_T = np.maximum.reduceat(T, block['starts'], axis=1)[:, family]
+    return i, (T >= t_obs).sum(axis=0), (max_T >= t_obs).sum(axis=0)
+
+
+def run_permutations(blocks, n_perm=10000, chunk_size=1000, seed=None, jobs=1):
+    # Chunks get independent child seeds spawned per block, so results do not depend on jobs
+    for block in blocks:
+        block['t_obs'] = observed_t(block)
+    sizes = [chunk_size] * (n_perm // chunk_size)
+    if n_perm % chunk_size:
+        sizes.append(n_perm % chunk_size)
+    tasks = []
+    for i, ss in enumerate(np.random.SeedSequence(seed).spawn(len(blocks))):
+        for size, chunk_ss in zip(sizes, ss.spawn(len(sizes))):
+            tasks.append((i, chunk_ss, size))
+
+    counts = [np.zeros(len(block['t_obs']), dtype=np.int64) for block in blocks]
+    counts_fwe = [np.zeros(len(block['t_obs']), dtype=np.int64) for block in blocks]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(blocks,)) as pool:
+            results = pool.map(run_chunk, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+            for i, c, c_fwe in results:
+                counts[i] += c
+                counts_fwe[i] += c_fwe
+    else:
+        init_worker(blocks)
+        for task in tasks:
+            i, c, c_fwe = run_chunk(task)
+            counts[i] += c
+            counts_fwe[i] += c_fwe
+
+    out = []
+    for block, c, c_fwe in zip(blocks, counts, counts_fwe):
+        if block['test'] == 'label':
+            n = block['rhs'][:, :block['Y'].shape[1]].sum(axis=0)
+        else:
+            n = block['n']
+        valid = np.isfinite(block['t_obs'])
+        out.append(pd.DataFrame({
+            'parcel_set': block['parcel_set'],
+            'experiment': block['experiment'],
+            'contrast': block['contrast'],
+            'fROI': block['fROI'],
+            'test': block['test'],
+            'n': n.astype(int),
+            't': block['t_obs'],
+            'p': np.where(valid, (c + 1) / (n_perm + 1), np.nan),
+            'p_fwe': np.where(valid, (c_fwe + 1) / (n_perm + 1), np.nan)
+        }, columns=RESULT_COLUMNS))
+
+    return pd.concat(out, axis=0, ignore_index=True)
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Nonparametric tests of every contrast: one-sample sign flipping (subject-label permutation for betweengroups),
+    with uncorrected and max-T family-wise corrected (across fROIs) p-values.
+    ''')
+    argparser.add_argument('-n', '--n_perm', type=int, default=10000, help='Number of permutations.')
+    argparser.add_argument('-c', '--chunk_size', type=int, default=1000, help='Permutations per chunk (bounds memory).')
+    argparser.add_argument('-s', '--seed', type=int, default=None, help='Random seed.')
+    argparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of worker processes (default: all cores).')
+    argparser.add_argument('-o', '--output', default='permutation.csv', help='Path to the results table.')
+    args = argparser.parse_args()
+
+    t0 = time.time()
+    try:
+        blocks = collect_blocks()
+    except FileNotFoundError:
+        sys.stderr.write('Contrast files not found. Run `python -m nlength.contrasts` before running this script.\n')
+        sys.stderr.flush()
+        exit()
+
+    out = run_permutations(blocks, n_perm=args.n_perm, chunk_size=args.chunk_size, seed=args.seed, jobs=args.jobs)
+    out.to_csv(args.output, index=False)
+    sys.stderr.write('Ran %d permutations of %d tests in %.2fs\n' % (args.n_perm, len(out), time.time() - t0))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
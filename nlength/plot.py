@@ -11,6 +11,8 @@ from mpl_toolkits.axes_grid1 import Divider, Size
 from statsmodels.nonparametric.smoothers_lowess import lowess
 import argparse
 
+from nlength.bootstrap import CI_METHODS, table_ci
+
 
 bar_width = 0.8
 capthick = 1
@@ -24,209 +26,238 @@ orangered = colors.to_rgba('orangered')
 dodgerblue = colors.to_rgba('dodgerblue')
 gray = colors.to_rgba('gray')
 gray = tuple([x if i < 3 else 0.4 for i, x in enumerate(gray)])
-plt.rcParams.update({'font.size': font_size, 'xtick.labelsize': tick_size, 'ytick.labelsize': tick_size})
-matplotlib.rcParams['font.sans-serif'] = "Arial"
-matplotlib.rcParams['font.family'] = "sans-serif"
-
-
-for parcel_set in ('evlab', 'PDD', 'RH', 'PDDanat'):
-    ylims = {'': {1: (-0.05, 1.1), 2: (-0.05, 0.35)}}
-    if parcel_set == 'evlab':
-        fROIs = [
-            'LIFGorb',
-            'LIFG',
-            'LMFG',
-            'LAntTemp',
-            'LPostTemp',
-            'LAngG'
-        ]
-    elif parcel_set.startswith('PDD'):
-        if parcel_set == 'PDDanat':
-            ylims['_tight'] = {1: (-0.05, 0.5), 2: (-0.02, 0.19)}
-        fROIs = [
-            'LIFGorb',
-            'LIFGtri',
-            'LTP',
-            'LaSTS',
-            'LpSTS',
-            'LTPJ',
-        ]
-    else:
-        fROIs = [
-            'RIFGorb',
-            'RIFG',
-            'RMFG',
-            'RAntTemp',
-            'RPostTemp',
-            'RAngG'
-        ]
 
-    try:
-        df1 = pd.read_csv('contrasts/%s_nlength1_contrasts.csv' % parcel_set)
-        df2 = pd.read_csv('contrasts/%s_nlength2_contrasts.csv' % parcel_set)
-    except FileNotFoundError:
-        sys.stderr.write('Contrast files not found. Run `python -m nlength.contrasts` before running this script.\n')
-        sys.stderr.flush()
-        exit()
-
-    # Main result
-
-    cmap = plt.get_cmap('terrain')
-    hatches = [
-        None,
-        '\\\\\\\\',
-        '||||',
-        '----',
-        '....',
-        'xxxx',
-        '++++'
-    ]
-    colors = [cmap(i/len(hatches)) for i in range(len(hatches))]
-    bar_width = 1./ 6 * 0.5
-
-
-    fig = plt.figure(figsize=((4, 4.5)))
-    h = [Size.Fixed(0.7), Size.Fixed(3.3)]
-    v = [Size.Fixed(0.5), Size.Fixed(3.7)]
-    divider = Divider(fig, (0, 0, 1, 1), h, v, aspect=False)
-    ax = fig.add_axes(
-        divider.get_position(),
-        axes_locator=divider.new_locator(nx=1, ny=1)
-    )
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(True)
-    ax.tick_params(labelleft='on', labelbottom='off')
-    ax.yaxis.set_ticks_position('left')
-    ax.xaxis.set_ticks_position('bottom')
-
-    contrast = 'C_v_J'
-
-
-    for i, fROI in enumerate(['all'] + fROIs):
-        r = i * bar_width
-
-        if fROI == 'all':
-            df = df2[contrast]
+
+def get_err(x, ci, fROI, contrast):
+    # Error bar extent below and above the mean: the SEM, or the bootstrap interval when ci is given
+    if ci is None:
+        err = float(x.sem())
+        return [err, err]
+    row = ci[(ci.fROI == fROI) & (ci.contrast == contrast)].iloc[0]
+    return [row['mean'] - row['lower'], row['upper'] - row['mean']]
+
+
+def main():
+    argparser = argparse.ArgumentParser('''
+    Bar plots of key contrasts by fROI.
+    ''')
+    argparser.add_argument('--ci', default='sem', choices=['sem'] + CI_METHODS, help='Error bars: SEM or bootstrap interval type.')
+    argparser.add_argument('--n_boot', type=int, default=10000, help='Number of bootstrap resamples.')
+    argparser.add_argument('--seed', type=int, default=None, help='Random seed for the bootstrap.')
+    args = argparser.parse_args()
+
+    plt.rcParams.update({'font.size': font_size, 'xtick.labelsize': tick_size, 'ytick.labelsize': tick_size})
+    matplotlib.rcParams['font.sans-serif'] = "Arial"
+    matplotlib.rcParams['font.family'] = "sans-serif"
+
+    for parcel_set in ('evlab', 'PDD', 'RH', 'PDDanat'):
+        ylims = {'': {1: (-0.05, 1.1), 2: (-0.05, 0.35)}}
+        if parcel_set == 'evlab':
+            fROIs = [
+                'LIFGorb',
+                'LIFG',
+                'LMFG',
+                'LAntTemp',
+                'LPostTemp',
+                'LAngG'
+            ]
+        elif parcel_set.startswith('PDD'):
+            if parcel_set == 'PDDanat':
+                ylims['_tight'] = {1: (-0.05, 0.5), 2: (-0.02, 0.19)}
+            fROIs = [
+                'LIFGorb',
+                'LIFGtri',
+                'LTP',
+                'LaSTS',
+                'LpSTS',
+                'LTPJ',
+            ]
         else:
-            df = df2[df2.fROI == fROI][contrast]
-        if contrast == 'C_v_J':
-            df = df
-        mean = float(df.mean())
-        err = float(df.sem())
-
-        ax.bar(
-            r,
-            mean,
-            # color='w',
-            color=colors[i],
-            edgecolor='none',
-            # edgecolor=(0.6, 0.6, 0.6),
-            width=bar_width,
-            label='Overall' if fROI == 'all' else fROI,
-            # hatch=hatches[i],
-            linewidth=2
-        )
+            fROIs = [
+                'RIFGorb',
+                'RIFG',
+                'RMFG',
+                'RAntTemp',
+                'RPostTemp',
+                'RAngG'
+            ]
 
-        ax.errorbar(
-            r,
-            mean,
-            yerr=err,
-            fmt='none',
-            ecolor=colors[i],
-            # ecolor=(0.8, 0.8, 0.8),
-            capsize=0,
-            capthick=2,
-            linewidth=2
-        )
+        try:
+            df1 = pd.read_csv('contrasts/%s_nlength1_contrasts.csv' % parcel_set)
+            df2 = pd.read_csv('contrasts/%s_nlength2_contrasts.csv' % parcel_set)
+        except FileNotFoundError:
+            sys.stderr.write('Contrast files not found. Run `python -m nlength.contrasts` before running this script.\n')
+            sys.stderr.flush()
+            exit()
 
-    ax.set_xticks([])
-    ax.set_xlim(-0.25, 0.75)
-    ax.axhline(y=0, color='k', lw=0.5)
-
-    for ylim_key in ylims:
-        ylim = ylims[ylim_key][1]
-        ax.set_ylim(ylim)
-        plt.savefig('plots/%s_overall1%s.png' % (parcel_set, ylim_key))
-    plt.close('all')
-
-
-    fig = plt.figure(figsize=((14, 4.5)))
-    h = [Size.Fixed(0.7), Size.Fixed(13.3)]
-    v = [Size.Fixed(0.5), Size.Fixed(3.7)]
-    divider = Divider(fig, (0, 0, 1, 1), h, v, aspect=False)
-    ax = fig.add_axes(
-        divider.get_position(),
-        axes_locator=divider.new_locator(nx=1, ny=1)
-    )
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(True)
-    ax.tick_params(labelleft='on', labelbottom='off')
-    ax.yaxis.set_ticks_position('left')
-    ax.xaxis.set_ticks_position('bottom')
-
-    contrasts = ['NLenC', 'NLenJ', 'NLenC_v_NLenJ']
-    contrasts_renamed = [''] * (len(contrasts) + 1)
-
-    r_base = np.arange(len(contrasts_renamed))
-
-    for i, fROI in enumerate(['all'] + fROIs):
-        r = r_base + i * bar_width
-        means = []
-        errs = []
-
-        if fROI == 'all':
-            df = df1[['NLenC']]
+        if args.ci == 'sem':
+            ci1 = ci2 = None
         else:
-            df = df1[df1.fROI == fROI][['NLenC']]
-        means.append(float(df.mean()))
-        errs.append(float(df.sem()))
+            ci1 = table_ci(df1, ['NLenC'], method=args.ci, n_boot=args.n_boot, seed=args.seed)
+            ci2 = table_ci(df2, ['C_v_J', 'NLenC', 'NLenJ', 'NLenC_v_NLenJ'], method=args.ci, n_boot=args.n_boot, seed=args.seed)
+
+        # Main result
+
+        cmap = plt.get_cmap('terrain')
+        hatches = [
+            None,
+            '\\\\\\\\',
+            '||||',
+            '----',
+            '....',
+            'xxxx',
+            '++++'
+        ]
+        colors = [cmap(i/len(hatches)) for i in range(len(hatches))]
+        bar_width = 1./ 6 * 0.5
+
+
+        fig = plt.figure(figsize=((4, 4.5)))
+        h = [Size.Fixed(0.7), Size.Fixed(3.3)]
+        v = [Size.Fixed(0.5), Size.Fixed(3.7)]
+        divider = Divider(fig, (0, 0, 1, 1), h, v, aspect=False)
+        ax = fig.add_axes(
+            divider.get_position(),
+            axes_locator=divider.new_locator(nx=1, ny=1)
+        )
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['bottom'].set_visible(False)
+        ax.spines['left'].set_visible(True)
+        ax.tick_params(labelleft='on', labelbottom='off')
+        ax.yaxis.set_ticks_position('left')
+        ax.xaxis.set_ticks_position('bottom')
+
+        contrast = 'C_v_J'
+
+
+        for i, fROI in enumerate(['all'] + fROIs):
+            r = i * bar_width
 
-        for contrast in contrasts:
             if fROI == 'all':
                 df = df2[contrast]
             else:
                 df = df2[df2.fROI == fROI][contrast]
             if contrast == 'C_v_J':
                 df = df
-            means.append(float(df.mean()))
-            errs.append(float(df.sem()))
-
-        ax.bar(
-            r,
-            means,
-            # color='w',
-            color=colors[i],
-            edgecolor='none',
-            # edgecolor=(0.6, 0.6, 0.6),
-            width=bar_width,
-            label='Overall' if fROI == 'all' else fROI,
-            # hatch=hatches[i],
-            linewidth=2
-        )
+            mean = float(df.mean())
+            err = get_err(df, ci2, fROI, contrast)
+
+            ax.bar(
+                r,
+                mean,
+                # color='w',
+                color=colors[i],
+                edgecolor='none',
+                # edgecolor=(0.6, 0.6, 0.6),
+                width=bar_width,
+                label='Overall' if fROI == 'all' else fROI,
+                # hatch=hatches[i],
+                linewidth=2
+            )
+
+            ax.errorbar(
+                r,
+                mean,
+                yerr=np.array(err)[:, None],
+                fmt='none',
+                ecolor=colors[i],
+                # ecolor=(0.8, 0.8, 0.8),
+                capsize=0,
+                capthick=2,
+                linewidth=2
+            )
+
+        ax.set_xticks([])
+        ax.set_xlim(-0.25, 0.75)
+        ax.axhline(y=0, color='k', lw=0.5)
 
-        ax.errorbar(
-            r,
-            means,
-            yerr=errs,
-            fmt='none',
-            ecolor=colors[i],
-            # ecolor=(0.8, 0.8, 0.8),
-            capsize=0,
-            capthick=2,
-            linewidth=2
+        for ylim_key in ylims:
+            ylim = ylims[ylim_key][1]
+            ax.set_ylim(ylim)
+            plt.savefig('plots/%s_overall1%s.png' % (parcel_set, ylim_key))
+        plt.close('all')
+
+
+        fig = plt.figure(figsize=((14, 4.5)))
+        h = [Size.Fixed(0.7), Size.Fixed(13.3)]
+        v = [Size.Fixed(0.5), Size.Fixed(3.7)]
+        divider = Divider(fig, (0, 0, 1, 1), h, v, aspect=False)
+        ax = fig.add_axes(
+            divider.get_position(),
+            axes_locator=divider.new_locator(nx=1, ny=1)
         )
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['bottom'].set_visible(False)
+        ax.spines['left'].set_visible(True)
+        ax.tick_params(labelleft='on', labelbottom='off')
+        ax.yaxis.set_ticks_position('left')
+        ax.xaxis.set_ticks_position('bottom')
+
+        contrasts = ['NLenC', 'NLenJ', 'NLenC_v_NLenJ']
+        contrasts_renamed = [''] * (len(contrasts) + 1)
+
+        r_base = np.arange(len(contrasts_renamed))
+
+        for i, fROI in enumerate(['all'] + fROIs):
+            r = r_base + i * bar_width
+            means = []
+            errs = []
+
+            if fROI == 'all':
+                df = df1[['NLenC']]
+            else:
+                df = df1[df1.fROI == fROI][['NLenC']]
+            means.append(float(df.mean()))
+            errs.append(get_err(df, ci1, fROI, 'NLenC'))
+
+            for contrast in contrasts:
+                if fROI == 'all':
+                    df = df2[contrast]
+                else:
+                    df = df2[df2.fROI == fROI][contrast]
+                if contrast == 'C_v_J':
+                    df = df
+                means.append(float(df.mean()))
+                errs.append(get_err(df, ci2, fROI, contrast))
+
+            ax.bar(
+                r,
+                means,
+                # color='w',
+                color=colors[i],
+                edgecolor='none',
+                # edgecolor=(0.6, 0.6, 0.6),
+                width=bar_width,
+                label='Overall' if fROI == 'all' else fROI,
+                # hatch=hatches[i],
+                linewidth=2
+            )
+
+            ax.errorbar(
+                r,
+                means,
+                yerr=np.array(errs).T,
+                fmt='none',
+                ecolor=colors[i],
+                # ecolor=(0.8, 0.8, 0.8),
+                capsize=0,
+                capthick=2,
+                linewidth=2
+            )
+
+        ax.legend(bbox_to_anchor=(1,1.1), ncol=4, fontsize=20)
+
+        ax.set_xticks([])
+        ax.axhline(y=0, color='k', lw=0.5)
 
-    ax.legend(bbox_to_anchor=(1,1.1), ncol=4, fontsize=20)
+        for ylim_key in ylims:
+            ylim = ylims[ylim_key][2]
+            ax.set_ylim(ylim)
+            plt.savefig('plots/%s_overall2%s.png' % (parcel_set, ylim_key))
+        plt.close('all')
 
-    ax.set_xticks([])
-    ax.axhline(y=0, color='k', lw=0.5)
 
-    for ylim_key in ylims:
-        ylim = ylims[ylim_key][2]
-        ax.set_ylim(ylim)
-        plt.savefig('plots/%s_overall2%s.png' % (parcel_set, ylim_key))
-    plt.close('all')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
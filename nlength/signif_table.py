@@ -4,16 +4,64 @@ import re
 import argparse
 import numpy as np
 import pandas as pd
-from statsmodels.stats.multitest import fdrcorrection
 
+from nlength.cache import get_key, cache_path, read_arrays, write_arrays, encode_table, decode_table
 
-def correct_p(x):
-    p = fdrcorrection(x['p'].values, method='negcorr')[1]
-    x['p_fdr'] = p
-    return x
+
+PARCEL_SETS = ['evlab', 'PDD', 'RH', 'betweenhemispheres', 'PDDanat']
+EXPERIMENTS = ['nlength1', 'nlength2', '6words', 'betweengroups']
+SUMMARY_SUFFIX = '.lrt.summary.txt'
+ROW_FIELDS = ['experiment', 'contrast', 'fROI', 'conv', 'sing', 'beta', 'se', 't', 'p']
+
+
+def grouped_fdr(p, groups=None, method='negcorr'):
+    # FDR-corrected p-values (as in statsmodels fdrcorrection) computed separately within each group,
+    # for all groups in one pass: stable sort by (group, p), within-group ranks, a reversed grouped
+    # cumulative minimum, and a scatter back to the input order. method is 'indep' (Benjamini-Hochberg)
+    # or 'negcorr' (Benjamini-Yekutieli). groups is an array of labels or a list of such arrays.
+    # NaN p-values are left out of the correction and stay NaN.
+    p = np.asarray(p, dtype=float)
+    n = len(p)
+    if groups is None:
+        codes = np.zeros(n, dtype=np.int64)
+    elif isinstance(groups, (list, tuple)):
+        keys = pd.DataFrame({i: np.asarray(x) for i, x in enumerate(groups)})
+        codes = keys.groupby(list(keys.columns), sort=False, dropna=False).ngroup().values
+    else:
+        codes = pd.factorize(np.asarray(groups), use_na_sentinel=False)[0]
+    if not n:
+        return p.copy()
+
+    order = np.lexsort((p, codes))
+    g = codes[order]
+    ps = p[order]
+    valid = np.isfinite(ps)
+    n_groups = codes.max() + 1
+    m = np.bincount(g[valid], minlength=n_groups)
+    start = np.searchsorted(g, np.arange(n_groups))
+    rank = np.arange(n) - start[g] + 1
+
+    if method in ('i', 'indep', 'p', 'poscorr'):
+        cm = np.ones(n_groups)
+    elif method in ('n', 'negcorr'):
+        harmonic = np.concatenate([[0.], np.cumsum(1. / np.arange(1, max(m.max(), 1) + 1))])
+        cm = harmonic[m]
+    else:
+        raise ValueError('Unrecognized FDR method: %s' % method)
+
+    adj = ps * m[g] * cm[g] / rank
+    adj = pd.Series(adj[::-1]).groupby(g[::-1]).cummin().values[::-1]
+    adj = np.minimum(adj, 1)
+
+    out = np.empty(n)
+    out[order] = adj
+    return out
 
 
 def get_stars(x):
+    # Missing p-values (e.g. failed fits in lrt/results.csv) get no stars
+    if pd.isna(x):
+        return ''
     if x > 0.1:
         return ''
     if x > 0.05:
@@ -25,10 +73,9 @@ def get_stars(x):
     return '***'
 
 
-def get_network_fdr(x):
-    if x.fROI != 'all':
-        return 'Ind'
-    return x.fROI
+def get_network_fdr(fROI):
+    # FDR family of each test: the pooled ('all') test, or the individual fROIs
+    return np.where(np.asarray(fROI) == 'all', 'all', 'Ind')
 
 
 # Thanks to Daniel Sparks on StackOverflow for this one (post available at
@@ -119,38 +166,123 @@ def compute_row(path, stars=True):
     }
 
 
-if __name__ == '__main__':
+def scan_summaries(directory='lrt'):
+    # Index all LRT summaries in one directory scan by (parcel_set, experiment, contrast, fROI).
+    # File names follow test_l2.R: <parcel_set>_<experiment>.<contrast>.<fROI>.lrt.summary.txt
+    # Files that map to the same key (e.g. <parcel_set>_<experiment>_old...) are all kept, as the previous
+    # prefix scan did, under the key extended with their file name, and reported on stderr.
+    index = {}
+    with os.scandir(directory) as entries:
+        entries = sorted(entries, key=lambda x: x.name)
+    for entry in entries:
+        name = entry.name
+        if not name.endswith(SUMMARY_SUFFIX):
+            continue
+        prefix = name.split('.')[0].split('_')
+        if len(prefix) < 2:
+            continue
+        contrast, fROI = name.split('.')[-5:-3]
+        key = (prefix[0], prefix[1], contrast, fROI)
+        if key in index:
+            sys.stderr.write('Warning: %s and %s are both LRT summaries for %s; keeping both.\n' % (
+                os.path.basename(index[key][0]), name, '/'.join(key)))
+            sys.stderr.flush()
+            key += (name,)
+        st = entry.stat()
+        index[key] = (entry.path, st.st_mtime_ns, st.st_size)
+    return index
+
+
+def read_summaries(index, directory='lrt'):
+    # Parse summaries through a columnar sidecar of previously parsed rows, keyed by path, mtime and size,
+    # so that only new or modified files are re-parsed
+    sidecar = cache_path(get_key(os.path.abspath(directory)), kind='lrt')
+    cached = {}
+    if os.path.exists(sidecar):
+        try:
+            arrays, meta = read_arrays(sidecar, mmap=False)
+            for x in decode_table(arrays, meta).to_dict('records'):
+                cached[x['path']] = x
+        except (ValueError, KeyError, OSError):
+            pass
+
+    rows = []
+    records = []
+    n_parsed = 0
+    for key in sorted(index, key=lambda x: index[x][0]):
+        path, mtime_ns, size = index[key]
+        x = cached.get(path)
+        if x is None or x['mtime_ns'] != mtime_ns or x['size'] != size:
+            x = compute_row(path, stars=False)
+            x.update(path=path, mtime_ns=mtime_ns, size=size)
+            n_parsed += 1
+        records.append(x)
+        row = {field: str(x[field]) for field in ROW_FIELDS}
+        row['parcel_set'] = key[0]
+        rows.append(row)
+
+    if n_parsed or len(cached) != len(records):
+        df = pd.DataFrame(records, columns=['path', 'mtime_ns', 'size'] + ROW_FIELDS)
+        df[ROW_FIELDS] = df[ROW_FIELDS].astype(str)
+        arrays, meta = encode_table(df)
+        try:
+            write_arrays(sidecar, arrays, meta)
+        except OSError as e:
+            sys.stderr.write('Could not write LRT sidecar (%s).\n' % e)
+    sys.stderr.write('Parsed %d of %d LRT summaries.\n' % (n_parsed, len(records)))
+    sys.stderr.flush()
+
+    return rows
+
+
+def read_results(path):
+    # Rows from the results table of nlength.group, in the same layout as compute_row
+    df = pd.read_csv(path)
+    rows = []
+    for x in df.to_dict('records'):
+        rows.append({
+            'parcel_set': x['parcel_set'],
+            'experiment': x['experiment'],
+            'contrast': x['contrast'],
+            'fROI': x['fROI'],
+            'conv': x['conv'],
+            'sing': x['sing'],
+            'beta': x['beta'],
+            'se': x['se'],
+            't': x['t'],
+            'p': x['p']
+        })
+    return rows
+
+
+def main():
     argparser = argparse.ArgumentParser('''
     Get table of significance values for conlen tests.
     ''')
+    argparser.add_argument('-r', '--results', default=os.path.join('lrt', 'results.csv'), help='Path to the results table written by nlength.group. If absent, the R summaries in lrt/ are parsed instead.')
     args = argparser.parse_args()
     cols = ['parcel_set', 'experiment', 'contrast', 'fROI', 'conv', 'sing', 'beta', 'se', 't', 'p']
     rows = []
-    for parcel_set in ['evlab', 'PDD', 'RH', 'betweenhemispheres', 'PDDanat']:
-        for experiment in ['nlength1', 'nlength2', '6words', 'betweengroups']:
-            directory = 'lrt'
-            paths = sorted([os.path.join(directory, x) for x in os.listdir(directory)
-                    if (x.startswith('%s_%s' % (parcel_set, experiment)) and x.endswith('.lrt.summary.txt'))])
-            for path in paths:
-                row = compute_row(path, stars=False)
-                row['parcel_set'] = parcel_set
-                rows.append(row)
+    if os.path.exists(args.results):
+        rows = read_results(args.results)
+    else:
+        index = scan_summaries('lrt')
+        index = {key: index[key] for key in index if key[0] in PARCEL_SETS and key[1] in EXPERIMENTS}
+        rows = read_summaries(index, 'lrt')
 
     rows = sorted(rows, key=lambda x: (x['parcel_set'], x['experiment'], len(x['contrast']), x['contrast'].split('!')[0]))
 
     df = pd.DataFrame(rows, columns=cols)
     df['p'] = df['p'].astype(float)
-    df['network_fdr'] = df[['fROI']].apply(get_network_fdr, axis=1)
-    df_p = df.groupby(['parcel_set', 'experiment', 'network_fdr', 'contrast']) \
-        .apply(correct_p)[['parcel_set', 'experiment', 'network_fdr', 'contrast', 'fROI', 'p_fdr']].reset_index(drop=True)
-    df = pd.merge(df, df_p, on=['parcel_set', 'experiment', 'network_fdr', 'contrast', 'fROI'])
+    df['network_fdr'] = get_network_fdr(df.fROI)
+    df['p_fdr'] = grouped_fdr(df.p.values, [df[x].values for x in ['parcel_set', 'experiment', 'network_fdr', 'contrast']])
     df['signif'] = df['p_fdr'].apply(get_stars)
     df.beta = df.beta.astype(float).round(2)
     df.se = df.se.astype(float).round(2)
     df.t = df.t.astype(float).round(2)
     df.p = np.maximum(df.p.astype(float), 0.001).round(3)
     df.p_fdr = np.maximum(df.p_fdr.astype(float), 0.001).astype(float).round(3)
-    df.parcel_set = pd.Categorical(df.parcel_set, ['evlab', 'PDD', 'RH', 'betweenhemispheres', 'PDDanat'])
+    df.parcel_set = pd.Categorical(df.parcel_set, PARCEL_SETS)
     df.fROI = pd.Categorical(
         df.fROI,
         [
@@ -189,3 +321,7 @@ if __name__ == '__main__':
     )
     df = df.sort_values(['parcel_set', 'experiment', 'contrast', 'fROI'])
     df.to_csv('signif.csv', index=False)
+
+
+if __name__ == '__main__':
+    main()
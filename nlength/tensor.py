@@ -0,0 +1,80 @@
+import functools
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+
+LinearFit = namedtuple('LinearFit', ['intercept', 'slope', 'resid_var'])
+
+
+def pivot_effects(df, rois, conditions, roi_col='ROI', condition_col='Condition', value_col='EffectSize'):
+    # Turn long-format spm_ss_mROI rows into a dense [subject, fROI, condition] array.
+    # Subjects are sorted, fROIs and conditions follow the order given. Missing cells are NaN.
+    df = df[df[roi_col].isin(rois) & df[condition_col].isin(conditions)]
+    subjects, s_ix = np.unique(df.Subject.values, return_inverse=True)
+    r_ix = pd.Index(rois).get_indexer(df[roi_col].values)
+    c_ix = pd.Index(conditions).get_indexer(df[condition_col].values)
+
+    X = np.full((len(subjects), len(rois), len(conditions)), np.nan)
+    ix = np.ravel_multi_index((s_ix, r_ix, c_ix), X.shape)
+    if len(np.unique(ix)) < len(ix):
+        raise ValueError('Duplicate (Subject, %s, %s) entries in EffectSize table.' % (roi_col, condition_col))
+    X.flat[ix] = df[value_col].values
+
+    return X, subjects
+
+
+def contrast_matrix(conditions, contrasts):
+    # Stack a dict of {name: {condition: weight}} into a [condition, contrast] weight matrix
+    W = np.zeros((len(conditions), len(contrasts)))
+    c_ix = {c: i for i, c in enumerate(conditions)}
+    for j, name in enumerate(contrasts):
+        for c, w in contrasts[name].items():
+            W[c_ix[c], j] += w
+
+    return W
+
+
+def apply_contrasts(X, conditions, contrasts):
+    # Compute every contrast for every subject and fROI with a single matrix product
+    W = contrast_matrix(conditions, contrasts)
+    Y = np.matmul(X, W)
+
+    return {name: Y[..., j] for j, name in enumerate(contrasts)}
+
+
+def combine(*terms):
+    # Linear combination of contrast weight dicts, e.g. combine((1, a), (-1, b))
+    out = {}
+    for coef, weights in terms:
+        for c, w in weights.items():
+            out[c] = out.get(c, 0.) + coef * w
+
+    return out
+
+
+def nansem(X, axis=0):
+    n = np.sum(np.isfinite(X), axis=axis)
+    return np.nanstd(X, axis=axis, ddof=1) / np.sqrt(n)
+
+
+@functools.lru_cache(maxsize=None)
+def design_pinv(x):
+    # Two-column design [1, x] and its pseudo-inverse, cached by the (hashable) basis
+    X = np.stack([np.ones(len(x)), np.array(x, dtype=float)], axis=1)
+    return X, np.linalg.pinv(X)
+
+
+def fit_slopes(D, x):
+    # Closed-form OLS of D[..., condition] on [1, x] for every leading index at once.
+    # Leading dimensions are arbitrary (e.g. [parcel_set, subject, fROI]).
+    X, P = design_pinv(tuple(float(v) for v in x))
+    b = np.einsum('pc,...c->...p', P, D)
+    resid = D - np.einsum('cp,...p->...c', X, b)
+    dof = len(x) - X.shape[1]
+    if dof > 0:
+        resid_var = np.sum(resid ** 2, axis=-1) / dof
+    else:
+        resid_var = np.full(D.shape[:-1], np.nan)
+
+    return LinearFit(b[..., 0], b[..., 1], resid_var)
@@ -20,6 +20,10 @@
 import re
 import sys
 
+TOKEN = re.compile('\\(|\\)|[^ ()]+')
+# levels Tree.__str__ recurses before switching to an explicit stack
+STR_DEPTH = 100
+
 # a Tree consists of a category label 'c' and a list of child Trees 'ch'
 class Tree:
 
@@ -33,66 +37,144 @@ class Tree:
 
     # obtain string from tree
     def __str__(self):
-        if self.ch == []:
-            if not hasattr(self, 'e'):
+        return self.to_str()
+
+    # recursive for ordinary trees; subtrees more than STR_DEPTH levels down use the explicit stack of str_parts,
+    # so arbitrarily deep trees neither hit the recursion limit nor go quadratic
+    def to_str(self, depth=0):
+        if not self.ch:
+            if 'e' not in self.__dict__:
                 return self.c
-            else:
-                return self.c + '[' + str(self.e) + ']'
+            return self.c + '[' + str(self.e) + ']'
+        if depth >= STR_DEPTH:
+            return ''.join(self.str_parts([]))
         s = '(' + self.c
-        if hasattr(self, 'e'):
+        if 'e' in self.__dict__:
             s += '[' + str(self.e) + ']'
-        for t in self.ch:
-            s += ' ' + t.__str__()
+        depth += 1
+        for ch in self.ch:
+            if type(ch) is str:
+                s += ' ' + ch
+            elif not ch.ch and 'e' not in ch.__dict__:
+                s += ' ' + ch.c
+            else:
+                s += ' ' + ch.to_str(depth)
         return s + ')'
 
+    # append the pieces of the bracketed tree to parts in document order, without recursion
+    def str_parts(self, parts):
+        append = parts.append
+        stack = [self]
+        push = stack.append
+        while stack:
+            t = stack.pop()
+            if type(t) is str:
+                append(t)
+                continue
+            c = t.c + '[' + str(t.e) + ']' if 'e' in t.__dict__ else t.c
+            if not t.ch:
+                append(c)
+                continue
+            append('(' + c)
+            # unannotated leaves go straight into the literal text between subtrees
+            text = ')'
+            for ch in t.ch[::-1]:
+                if type(ch) is str:
+                    text = ' ' + ch + text
+                elif not ch.ch and 'e' not in ch.__dict__:
+                    text = ' ' + ch.c + text
+                else:
+                    push(text)
+                    push(ch)
+                    text = ' '
+            push(text)
+        return parts
+
+    # all nodes in document order (preorder), starting with self
+    def iter_nodes(self):
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            yield t
+            ch = t.ch
+            if ch and type(ch[0]) is not str:
+                stack.extend(ch[::-1])
+
+    def iter_words(self):
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            ch = t.ch
+            if not ch:
+                yield t.c
+            elif type(ch[0]) is str:
+                yield from ch
+            else:
+                stack.extend(ch[::-1])
+
+    # categories of preterminals (unary nodes over a leaf) in document order
+    def iter_syncats(self):
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            ch = t.ch
+            if len(ch) == 1 and not ch[0].ch:
+                yield t.c
+            elif ch and type(ch[0]) is str:
+                yield from ch
+            else:
+                stack.extend(ch[::-1])
 
     def words(self):
-        if self.ch == []:
-            return [self.c]
-        else:
-            if type(self.ch[0]) is str:
-                return self.ch
-            l = []
-            for t in self.ch:
-                l += t.words()
-            return l
+        return list(self.iter_words())
 
     def syncats(self):
-        if len(self.ch) == 1 and len(self.ch[0].ch) == 0:
-            return [self.c]
-        else:
-            if type(self.ch[0]) is str:
-                return self.ch
-            l = []
-            for t in self.ch:
-                l += t.syncats()
-            return l
+        return list(self.iter_syncats())
 
     # obtain tree from string
+    # single left-to-right scan over tokens, with an explicit stack of open constituents
     def read(self,s,fIndex=0):
         self.ch = []
-        # parse a string delimited by whitespace as a terminal branch (a leaf)
-        m = re.search('^ *([^ ()]+) *(.*)',s)
-        if m != None:
-            (self.c,s) = m.groups()
-            self.l = fIndex
-            self.r = fIndex
-            return s, fIndex+1
-        # parse nested parens as a non-terminal branch
-        m = re.search('^ *\( *([^ ()]*) *(.*)',s)
-        if m != None:
-            (self.c,s) = m.groups()
-            self.l = fIndex
-            # read children until close paren
-            while True:
-                m = re.search('^ *\) *(.*)',s)
-                if m != None:
-                    return m.group(1), fIndex
-                t = Tree()
-                s, fIndex = t.read(s, fIndex)
-                self.ch += [t]
-                t.p = self
-                self.r = t.r
+        stack = []
+        expect_c = False
+        for m in TOKEN.finditer(s):
+            tok = m.group()
+            # the first atom after an open paren is the category (possibly empty)
+            if expect_c:
+                expect_c = False
+                if tok != '(' and tok != ')':
+                    stack[-1].c = tok
+                    continue
+                stack[-1].c = ''
+            if tok == '(':
+                if stack:
+                    t = Tree('', [], stack[-1], fIndex)
+                    stack[-1].ch.append(t)
+                else:
+                    t = self
+                    t.l = fIndex
+                stack.append(t)
+                expect_c = True
+            elif tok == ')':
+                if not stack:
+                    return ''
+                t = stack.pop()
+                if not stack:
+                    return s[m.end():].lstrip(' '), fIndex
+                stack[-1].r = t.r
+            elif stack:
+                # terminal branch (a leaf)
+                t = Tree(tok, [], stack[-1], fIndex, fIndex)
+                stack[-1].ch.append(t)
+                stack[-1].r = fIndex
+                fIndex += 1
+            else:
+                self.c = tok
+                self.l = fIndex
+                self.r = fIndex
+                return s[m.end():].lstrip(' '), fIndex+1
+        if stack:
+            raise ValueError('Unbalanced parentheses in tree: ' + s.strip())
         return ''
 
     def collapseUnary(self):
@@ -104,7 +186,15 @@ class Tree:
             ch.collapseUnary()
 
     # return the lowest child, but not leaf, that spans the range
-    def findBySpan(self, left, right):
+    # with a TreeIndex of the enclosing tree, the lookup is a dictionary access
+    def findBySpan(self, left, right, index=None):
+        if index is not None:
+            if left < self.l or right > self.r:
+                return None
+            t = index.findBySpan(left, right, self)
+            if t is None:
+                raise ValueError('No node span the range: ' + str(left) + ',' + str(right))
+            return t
         #sys.stderr.write( 'left: ' + str(left) + ' right: ' + str(right) + '\n')
         #sys.stderr.write( 's.left: ' + str(self.l) + ' s.right: ' + str(self.r) + '\n')
         if self.l == 0 and self.r == 0:
@@ -130,7 +220,7 @@ class Tree:
             val = child.findBySpan(left, right)
             if val != None:
                 return val
-        raise 'No node span the range: ' + str(left) + ',' + str(right)
+        raise ValueError('No node span the range: ' + str(left) + ',' + str(right))
 
 
     def findByLeftAndHeight(self, left, height):
@@ -182,8 +272,8 @@ class Tree:
             p = p.p
         return ancestors
     
-    def findArgBoundaries(self, predicateIdx, argHeadwordIdx, allHeadwordIdxs):
-        maxProj = self.findMaxProj(predicateIdx, argHeadwordIdx, allHeadwordIdxs)
+    def findArgBoundaries(self, predicateIdx, argHeadwordIdx, allHeadwordIdxs, index=None):
+        maxProj = self.findMaxProj(predicateIdx, argHeadwordIdx, allHeadwordIdxs, index)
         return maxProj.l, maxProj.r
     
     def leftBoundary(self):
@@ -204,17 +294,26 @@ class Tree:
                 return True
         return False
     
-    def findMaxProj(self, predicateIdx, argHeadwordIdx, allHeadwordIdxs):
-        predTree = self.treeAt(predicateIdx)
-        argTree = self.treeAt(argHeadwordIdx)
+    def findMaxProj(self, predicateIdx, argHeadwordIdx, allHeadwordIdxs, index=None):
+        predTree = self.treeAt(predicateIdx, index)
+        argTree = self.treeAt(argHeadwordIdx, index)
+        if index is not None:
+            while not index.isAncestor(argTree.p, predTree) and not argTree.p.coverOtherArg(argHeadwordIdx, allHeadwordIdxs):
+                argTree = argTree.p
+            return argTree
         predAncestors = predTree.getAncestors()
         while (not argTree.p in predAncestors) and not argTree.p.coverOtherArg(argHeadwordIdx, allHeadwordIdxs):
             argTree = argTree.p 
         return argTree
     
-    def treeAt(self, idx):
+    def treeAt(self, idx, index=None):
         if idx < self.l or idx > self.r:
-            raise 'idx is out of range'
+            raise ValueError('idx is out of range')
+        if index is not None:
+            t = index.treeAt(idx, self)
+            if t is None:
+                raise ValueError('No node at index: ' + str(idx))
+            return t
         if self.l == self.r and self.l == idx:
             return self
         if idx <= self.ch[0].r:
@@ -247,4 +346,69 @@ class Tree:
         if lColor:
             annotatedCat = re.sub('(\-[l][A-Z])', '{\\\\' + lColor + r' \1}', annotatedCat) 
         return annotatedCat
-    
+
+
+# write trees one per line with a single buffered write
+def write_trees(trees, f):
+    s = ''.join([str(t) + '\n' for t in trees])
+    if isinstance(f, str):
+        with open(f, 'w') as f:
+            f.write(s)
+    else:
+        f.write(s)
+
+
+# span and ancestry lookups for one tree, built once in a single iterative pass
+# spans and leaves map to nodes in preorder, so the first match inside a subtree is what the
+# recursive descents of findBySpan and treeAt return; ancestry uses Euler tour entry/exit times
+class TreeIndex:
+
+    def __init__(self, t):
+        self.root = t
+        self.spans = {}
+        self.leaves = {}
+        self.tin = {}
+        self.tout = {}
+        time = 0
+        stack = [(t, False)]
+        while stack:
+            t, done = stack.pop()
+            if done:
+                self.tout[t] = time
+                continue
+            self.tin[t] = time
+            time += 1
+            self.spans.setdefault((t.l, t.r), []).append(t)
+            if t.l == t.r:
+                self.leaves.setdefault(t.l, []).append(t)
+            stack.append((t, True))
+            for ch in reversed(t.ch):
+                stack.append((ch, False))
+
+    # True if a is b or an ancestor of b
+    def isAncestor(self, a, b):
+        if a is None or b is None:
+            return False
+        return self.tin[a] <= self.tin[b] and self.tout[b] <= self.tout[a]
+
+    def first(self, nodes, root=None):
+        if root is None or root is self.root:
+            return nodes[0]
+        for t in nodes:
+            if self.isAncestor(root, t):
+                return t
+        return None
+
+    # highest node (first in preorder) under root with span (left, right), or None
+    def findBySpan(self, left, right, root=None):
+        nodes = self.spans.get((left, right))
+        if not nodes:
+            return None
+        return self.first(nodes, root)
+
+    # highest node (first in preorder) under root whose span is the single position idx, or None
+    def treeAt(self, idx, root=None):
+        nodes = self.leaves.get(idx)
+        if not nodes:
+            return None
+        return self.first(nodes, root)
@@ -0,0 +1,343 @@
+import array
+import numpy as np
+
+from nlength.tree import Tree, TOKEN
+from nlength.cache import write_arrays, read_arrays
+
+
+# Bump whenever parsing or collapse_unary changes, to invalidate cached treebanks
+TREEBANK_VERSION = 1
+FIELDS = ['label', 'word', 'parent', 'first_child', 'next_sibling', 'l', 'r']
+NARROW = ['label', 'l', 'r']
+
+
+def child_links(parent):
+    # first_child and next_sibling from a preorder parent array
+    n = len(parent)
+    first_child = np.full(n, -1, dtype=np.int32)
+    next_sibling = np.full(n, -1, dtype=np.int32)
+    nodes = np.flatnonzero(parent >= 0)
+    order = nodes[np.argsort(parent[nodes], kind='stable')]
+    par = parent[order]
+    same = par[1:] == par[:-1]
+    next_sibling[order[:-1][same]] = order[1:][same]
+    start = np.ones(len(order), dtype=bool)
+    start[1:] = ~same
+    first_child[par[start]] = order[start]
+    return first_child, next_sibling
+
+
+def ancestor_sums(parent, weights):
+    # Sum of weights over every node's ancestors-or-self by pointer jumping: each round adds the partial
+    # sum of the node the pointer reaches and doubles the jump, so ceil(log2(depth)) vectorized rounds.
+    # Roots point to a zero-weight sentinel (node n), which points to itself.
+    n = len(parent)
+    weights = np.asarray(weights)
+    s = np.zeros((n + 1,) + weights.shape[1:], dtype=np.int64)
+    s[:n] = weights
+    nxt = np.append(np.where(parent >= 0, parent, n), n)
+    while (nxt[:n] != n).any():
+        s += s[nxt]
+        nxt = nxt[nxt]
+    return s[:n]
+
+
+def chain_tops(parent, climb):
+    # For every node, the highest node reached by moving up to the parent while `climb` holds for the current
+    # node, by pointer jumping
+    n = len(parent)
+    nxt = np.where(climb & (parent >= 0), parent, np.arange(n))
+    while True:
+        jump = nxt[nxt]
+        if (jump == nxt).all():
+            return nxt
+        nxt = jump
+
+
+class Treebank:
+    # A whole corpus of trees as flat integer arrays over nodes. Each tree is a contiguous range of node ids
+    # (offsets[i]:offsets[i + 1]) in preorder, so parents precede their children. Node links (parent,
+    # first_child, next_sibling) are global node ids, -1 if absent. Internal nodes carry a category code
+    # (label, into labels) and word == -1; leaves carry a word id (word, into words) and label == -1.
+    # l and r are word positions as in Tree.read.
+
+    def __init__(self, label, word, parent, first_child, next_sibling, l, r, offsets, labels, words):
+        self.label = label
+        self.word = word
+        self.parent = parent
+        self.first_child = first_child
+        self.next_sibling = next_sibling
+        self.l = l
+        self.r = r
+        self.offsets = offsets
+        self.labels = labels
+        self.words = words
+
+    @classmethod
+    def from_lines(cls, lines):
+        # Parse bracketed trees (one per line) straight into arrays, with the semantics of Tree.read.
+        # Blank lines give empty trees, so tree i is always line i.
+        label, word, parent, first_child, next_sibling, l, r = [array.array('i') for _ in FIELDS]
+        offsets = array.array('q', [0])
+        labels = {'': 0}
+        words = {}
+
+        def add(lab, wd, par, left, right):
+            i = len(label)
+            label.append(lab)
+            word.append(wd)
+            parent.append(par)
+            first_child.append(-1)
+            next_sibling.append(-1)
+            l.append(left)
+            r.append(right)
+            return i
+
+        for line in lines:
+            stack = []
+            last = []
+            expect_c = False
+            fIndex = 0
+            for m in TOKEN.finditer(line):
+                tok = m.group()
+                if expect_c:
+                    expect_c = False
+                    if tok != '(' and tok != ')':
+                        label[stack[-1]] = labels.setdefault(tok, len(labels))
+                        continue
+                if tok == '(':
+                    par = stack[-1] if stack else -1
+                    i = add(0, -1, par, fIndex, 0)
+                    if stack:
+                        if last[-1] < 0:
+                            first_child[par] = i
+                        else:
+                            next_sibling[last[-1]] = i
+                        last[-1] = i
+                    stack.append(i)
+                    last.append(-1)
+                    expect_c = True
+                elif tok == ')':
+                    if not stack:
+                        break
+                    i = stack.pop()
+                    last.pop()
+                    if not stack:
+                        break
+                    r[stack[-1]] = r[i]
+                elif stack:
+                    par = stack[-1]
+                    i = add(-1, words.setdefault(tok, len(words)), par, fIndex, fIndex)
+                    if last[-1] < 0:
+                        first_child[par] = i
+                    else:
+                        next_sibling[last[-1]] = i
+                    last[-1] = i
+                    r[par] = fIndex
+                    fIndex += 1
+                else:
+                    add(-1, words.setdefault(tok, len(words)), -1, fIndex, fIndex)
+                    break
+            if stack:
+                raise ValueError('Unbalanced parentheses in tree: ' + line.strip())
+            offsets.append(len(label))
+
+        return cls.pack(label, word, parent, first_child, next_sibling, l, r, offsets, labels, words)
+
+    @classmethod
+    def pack(cls, label, word, parent, first_child, next_sibling, l, r, offsets, labels, words):
+        # Freeze accumulated arrays; category codes and spans are stored as int16 when they fit
+        fields = []
+        for name, x in zip(FIELDS, (label, word, parent, first_child, next_sibling, l, r)):
+            x = np.array(x, dtype=np.int32)
+            if name in NARROW and (not len(x) or (x.min() >= -1 and x.max() < 2 ** 15)):
+                x = x.astype(np.int16)
+            fields.append(x)
+        return cls(*fields, np.array(offsets, dtype=np.int64), list(labels), list(words))
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_lines(f)
+
+    @classmethod
+    def from_trees(cls, trees):
+        # Pack Tree objects (childless nodes become leaves)
+        label, word, parent, first_child, next_sibling, l, r = [array.array('i') for _ in FIELDS]
+        offsets = array.array('q', [0])
+        labels = {'': 0}
+        words = {}
+        for t in trees:
+            last = {}
+            stack = [(t, -1)]
+            while stack:
+                t, par = stack.pop()
+                i = len(label)
+                if t.ch:
+                    label.append(labels.setdefault(t.c, len(labels)))
+                    word.append(-1)
+                else:
+                    label.append(-1)
+                    word.append(words.setdefault(t.c, len(words)))
+                parent.append(par)
+                first_child.append(-1)
+                next_sibling.append(-1)
+                l.append(t.l)
+                r.append(t.r)
+                if par >= 0:
+                    if par in last:
+                        next_sibling[last[par]] = i
+                    else:
+                        first_child[par] = i
+                    last[par] = i
+                for ch in reversed(t.ch):
+                    stack.append((ch, i))
+            offsets.append(len(label))
+
+        return cls.pack(label, word, parent, first_child, next_sibling, l, r, offsets, labels, words)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.tree(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.tree(i)
+
+    @property
+    def n_nodes(self):
+        return len(self.label)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, x).nbytes for x in FIELDS) + self.offsets.nbytes
+
+    def n_children(self):
+        parent = self.parent[self.parent >= 0]
+        return np.bincount(parent, minlength=self.n_nodes)
+
+    def collapse_unary(self):
+        # Vectorized Tree.collapseUnary over the whole treebank: drop every internal node that is the sole
+        # child of its parent, reattaching its children to the nearest kept ancestor
+        n = self.n_nodes
+        parent = self.parent.astype(np.int64)
+        has_parent = parent >= 0
+        drop = (self.first_child >= 0) & has_parent
+        drop[has_parent] &= self.n_children()[parent[has_parent]] == 1
+        keep = ~drop
+
+        # nearest kept ancestor-or-self, by pointer jumping over chains of dropped nodes
+        nearest = np.where(keep, np.arange(n), parent)
+        while not keep[nearest].all():
+            nearest = np.where(keep[nearest], nearest, nearest[nearest])
+
+        new_id = np.cumsum(keep) - 1
+        kept = np.flatnonzero(keep)
+        parent = parent[kept]
+        parent = np.where(parent >= 0, new_id[nearest[np.maximum(parent, 0)]], -1).astype(np.int32)
+        first_child, next_sibling = child_links(parent)
+        offsets = np.concatenate([[0], np.cumsum(keep)])[self.offsets]
+
+        return Treebank(
+            self.label[kept],
+            self.word[kept],
+            parent,
+            first_child,
+            next_sibling,
+            self.l[kept],
+            self.r[kept],
+            offsets.astype(np.int64),
+            self.labels,
+            self.words
+        )
+
+    def tree(self, i):
+        # Build the Tree of sentence i on demand
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if start == end:
+            return Tree()
+        label = self.label[start:end].tolist()
+        word = self.word[start:end].tolist()
+        parent = (self.parent[start:end] - start).tolist()
+        l = self.l[start:end].tolist()
+        r = self.r[start:end].tolist()
+        nodes = []
+        for j in range(end - start):
+            c = self.words[word[j]] if word[j] >= 0 else self.labels[label[j]]
+            p = nodes[parent[j]] if parent[j] >= 0 else None
+            t = Tree(c, [], p, l[j], r[j])
+            if p is not None:
+                p.ch.append(t)
+            nodes.append(t)
+        return nodes[0]
+
+    def lines(self, start=0, stop=None):
+        # Bracketed strings of sentences start:stop straight from the arrays (as str(self.tree(i)))
+        if stop is None:
+            stop = len(self)
+        lo, hi = int(self.offsets[start]), int(self.offsets[stop])
+        label = self.label[lo:hi].tolist()
+        word = self.word[lo:hi].tolist()
+        parent = (self.parent[lo:hi] - lo).tolist()
+        has_child = (self.first_child[lo:hi] >= 0).tolist()
+        has_sibling = (self.next_sibling[lo:hi] >= 0).tolist()
+        offsets = (self.offsets[start:stop + 1] - lo).tolist()
+        labels = ['(' + x for x in self.labels]
+        words = self.words
+        for i in range(stop - start):
+            parts = []
+            for j in range(offsets[i], offsets[i + 1]):
+                if parts:
+                    parts.append(' ')
+                if word[j] >= 0:
+                    parts.append(words[word[j]])
+                elif has_child[j]:
+                    parts.append(labels[label[j]])
+                    continue
+                else:
+                    # a childless internal node prints as a bare label, as in Tree.__str__
+                    parts.append(self.labels[label[j]])
+                # node j is complete: close every ancestor it completes
+                x = j
+                while not has_sibling[x] and parent[x] >= 0:
+                    x = parent[x]
+                    parts.append(')')
+            yield ''.join(parts)
+
+    def line(self, i):
+        return next(self.lines(i, i + 1))
+
+    def write(self, path):
+        # Write the treebank as linetrees with a single buffered write
+        with open(path, 'w') as f:
+            f.write(''.join([x + '\n' for x in self.lines()]))
+
+    def leaves(self, i=None):
+        # Global node ids of the leaves (of sentence i), in word order
+        if i is None:
+            return np.flatnonzero(self.word >= 0)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return start + np.flatnonzero(self.word[start:end] >= 0)
+
+    def sentence(self, i):
+        return [self.words[x] for x in self.word[self.leaves(i)]]
+
+    def arrays(self):
+        arrays = {x: getattr(self, x) for x in FIELDS}
+        arrays['offsets'] = self.offsets
+        return arrays, {'version': TREEBANK_VERSION, 'labels': self.labels, 'words': self.words}
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        if meta.get('version') != TREEBANK_VERSION:
+            raise ValueError('Treebank version %s, expected %s.' % (meta.get('version'), TREEBANK_VERSION))
+        return cls(*[arrays[x] for x in FIELDS], arrays['offsets'], meta['labels'], meta['words'])
+
+    def save(self, path):
+        write_arrays(path, *self.arrays())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        return cls.from_arrays(*read_arrays(path, mmap=mmap))
@@ -0,0 +1,41 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from nlength.permutation import make_block, run_permutations
+
+
+def contrast_table(values):
+    # Long-form contrast table (Subject, fROI, C) from {fROI: per-subject values}
+    rows = []
+    for fROI, x in values.items():
+        for i, v in enumerate(x):
+            rows.append({'Subject': 's%d' % i, 'fROI': fROI, 'C': v})
+    return pd.DataFrame(rows)
+
+
+def test_nonfinite_t_is_not_tested():
+    rng = np.random.default_rng(0)
+    values = {
+        'strong': 1. + 0.1 * rng.standard_normal(16),
+        'null': rng.standard_normal(16),
+        'single': [2.] + [np.nan] * 15,
+        'constant': [3.] * 16,
+    }
+    block = make_block('evlab', 'nlength1', ['C'], contrast_table(values))
+    reference = make_block('evlab', 'nlength1', ['C'], contrast_table({x: values[x] for x in ['strong', 'null']}))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        out = run_permutations([block], n_perm=999, chunk_size=250, seed=1).set_index('fROI')
+    expected = run_permutations([reference], n_perm=999, chunk_size=250, seed=1).set_index('fROI')
+
+    for fROI in ['single', 'constant']:
+        assert not np.isfinite(out.loc[fROI, 't'])
+        assert np.isnan(out.loc[fROI, 'p'])
+        assert np.isnan(out.loc[fROI, 'p_fwe'])
+    # untestable fROIs do not change the family max of the others
+    for fROI in ['strong', 'null']:
+        assert out.loc[fROI, 'p'] == expected.loc[fROI, 'p']
+        assert out.loc[fROI, 'p_fwe'] == expected.loc[fROI, 'p_fwe']
+    assert out.loc['strong', 'p'] < 0.01
+    assert out.loc['null', 'p'] > 0.01